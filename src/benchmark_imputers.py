@@ -0,0 +1,70 @@
+"""Compare the imputer backends of imputation.py on the final splits.
+
+For each imputer, the preprocessing of get_data (fit on the eICU train split, transform the other splits) is
+timed and its peak memory traced (Python and numpy allocations, via tracemalloc). A Cox model with the
+hyperparameters of the final model in pipeline.py is then fit on the imputed train split, and its concordance
+reported on every split, along with the difference from MissForest.
+
+  python benchmark_imputers.py --outcome deceased --methods missforest iterative_ridge knn median
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+from lifelines import CoxPHFitter
+from lifelines.utils import concordance_index
+
+import imputation
+import preprocess
+
+
+def benchmark(method, dfs, outcome, seed, penalizer, l1_ratio):
+  tracemalloc.start()
+  start = time.time()
+  prep = preprocess.Preprocessor(outcome, seed=seed, impute=method)
+  out = {'train': prep.fit_transform(dfs['train'])}
+  for split in preprocess.SPLITS[1:]:
+    out[split] = prep.transform(dfs[split])
+  seconds = time.time() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  X, y, _ = out['train']
+  dataset = X.copy()
+  for col in y.columns:
+    dataset[col] = y[col].tolist()
+  cph = CoxPHFitter(penalizer=penalizer, l1_ratio=l1_ratio)
+  cph.fit(dataset, duration_col=y.columns[0], event_col=y.columns[1])
+
+  row = {'method': method, 'seconds': seconds, 'peak_mb': peak / 2. ** 20, 'n_features': X.shape[1]}
+  for split, (X, y, _) in out.items():
+    row['c_' + split] = concordance_index(y.iloc[:, 0], -cph.predict_partial_hazard(X), y.iloc[:, 1])
+  return row
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--methods', nargs='+', default=imputation.IMPUTERS, choices=imputation.IMPUTERS)
+  parser.add_argument('--outcome', default="deceased", action="store")
+  parser.add_argument('--seed', type=int, default=499, action="store")
+  parser.add_argument('--penalizer', type=float, default=0.025, action="store")
+  parser.add_argument('--l1_ratio', type=float, default=1.0, action="store")
+  parser.add_argument('--out', default=None, action="store", help='also write the table to this csv')
+  args = parser.parse_args()
+
+  dfs = dict(zip(preprocess.SPLITS, preprocess.load_csv('any', 2, -1, return_viral=True)))
+  rows = []
+  for method in args.methods:
+    print('Benchmarking {}...'.format(method))
+    rows.append(benchmark(method, dfs, args.outcome, args.seed, args.penalizer, args.l1_ratio))
+
+  results = pd.DataFrame(rows).set_index('method')
+  c_cols = [c for c in results.columns if c.startswith('c_')]
+  if 'missforest' in results.index:
+    for c in c_cols:
+      results['d' + c] = results[c] - results.loc['missforest', c]
+  print(results.round(4).to_string())
+  if args.out is not None:
+    results.to_csv(args.out)
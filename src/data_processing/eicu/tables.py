@@ -6,10 +6,21 @@ After joining the cohort with its features and outcomes, this script creates a v
 0, 24, and 48 hours after admission into the ICU. All features values are taken as the latest feature up
 until that point in that patient's hospital admission (or null if there are none up until that point). 
 Time to outcome event is computed as the time of the first event relative to the start of the corresponding 
-day (at 0, 24, and 48 hours).
+day (at 0, 24, and 48 hours). Other horizons can be requested in hours with --hours; by default all of
+them are built from a single ordered scan of the feature table.
 """
 
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import re
+import time
+
 import psycopg2
+import psycopg2.pool
 import pandas as pd
 
 
@@ -45,15 +56,88 @@ MV_STRINGS = (  # mechanical ventilation strings
   'pulmonary|ventilation and oxygenation|mechanical ventilation|volume assured',
   'pulmonary|ventilation and oxygenation|mechanical ventilation|non-invasive ventilation|nasal mask')
 
+SNAPSHOT_COLS = [  # columns written to the per-day csvs
+  'rbcs', 'wbc', 'platelets',
+  'hemoglobin', 'hct', 'rdw', 'mcv', 'mch', 'mchc', 'neutrophils',
+  'lymphocytes', 'monocytes', 'eosinophils', 'basophils', 'bun',
+  'temperature', 'ph', 'sodium', 'glucose', 'pao2', 'fio2', 'ldh', 'crp',
+  'direct_bilirubin', 'total_bilirubin', 'total_protein', 'albumin',
+  'ferritin', 'pt', 'ptt', 'fibrinogen', 'ast', 'alt', 'creatinine',
+  'troponin', 'alkaline_phosphatase', 'bands', 'bicarbonate', 'calcium',
+  'chloride', 'potassium', 'gender', 'age', 'ethnicity',
+  'heart_rate', 'sao2', 'gcs', 'respiratory_rate',
+  'bp_systolic', 'bp_diastolic', 'bp_mean_arterial', 'smoking', 'pleural_effusion',
+  'nursing_home', 'chest_xray',
+  'orientation', 'censor_or_deceased_days', 'deceased_indicator',
+  'censor_or_vasopressor_days', 'vasopressor_indicator',
+  'censor_or_ventilator_days', 'ventilator_indicator']
+
+FEATURES0_QUERY = (  # full join of the per-source feature tables created by eicu_extraction.sql
+  "CREATE table {shortname}_features0 as "
+  "SELECT COALESCE(d.patientunitstayid, l.patientunitstayid, v.patientunitstayid, "
+  "n.patientunitstayid, c.patientunitstayid, a.patientunitstayid) as patientunitstayid, "
+  "COALESCE(l.t_offset, v.t_offset, n.t_offset, c.t_offset, a.t_offset) as t_offset, "
+  "COALESCE(l.temperature, v.temperature, n.temperature) as temperature, "
+  "coalesce(cast(n.bp_systolic as float), v.bp_systolic) as bp_systolic, "
+  "coalesce(cast(n.bp_diastolic as float), v.bp_diastolic) as bp_diastolic, "
+  "coalesce(cast(n.bp_mean as float), v.bp_mean) as bp_mean_arterial, "
+  "rbcs, wbc, platelets, hemoglobin, hct, rdw, mcv, mch, mchc, "
+  "neutrophils, lymphocytes, monocytes, eosinophils, basophils, "
+  "bun, ph, sodium, glucose, pao2, fio2, ldh, crp, direct_bilirubin, total_bilirubin, total_protein, "
+  "albumin, ferritin, pt, ptt, fibrinogen, ast, alt, creatinine, troponin, alkaline_phosphatase, "
+  "bands, bicarbonate, calcium, chloride, potassium, "
+  "d.gender, d.age, d.ethnicity, "
+  "v.heart_rate, v.sao2, "
+  "COALESCE(CAST(n.respiratory_rate AS FLOAT), CAST(v.respiratory_rate AS FLOAT)) as respiratory_rate, "
+  "COALESCE(n.gcs, n.gcs2) as gcs, "
+  "c.smoking, "
+  "COALESCE(c.pleural_effusion, 0) as pleural_effusion, "
+  "COALESCE(a.orientation,  n.gcs_orientation) as orientation, "
+  "d.nursing_home as nursing_home, "
+  "r.chest_xray as chest_xray "
+  "FROM {shortname}_demographics d "
+  "FULL JOIN {shortname}_labs l "
+  "ON d.patientunitstayid = l.patientunitstayid "
+  "FULL JOIN {shortname}_vitals v "
+  "ON l.t_offset= v.t_offset and v.patientunitstayid = l.patientunitstayid "
+  "FULL JOIN {shortname}_nurse_charting n "
+  "ON n.t_offset= v.t_offset and v.patientunitstayid = n.patientunitstayid "
+  "FULL JOIN {shortname}_comorbidities c "
+  "ON c.t_offset= n.t_offset and c.patientunitstayid = n.patientunitstayid "
+  "FULL JOIN {shortname}_amt a "
+  "ON a.t_offset= c.t_offset and a.patientunitstayid=c.patientunitstayid "
+  "FULL JOIN {shortname}_xray r "
+  "ON r.t_offset= a.t_offset and r.patientunitstayid=a.patientunitstayid "
+  "ORDER BY patientunitstayid, t_offset;")
+
+FEATURE_TABLES = ['demographics', 'labs', 'vitals', 'nurse_charting', 'comorbidities', 'amt', 'xray']
+
+# one unit of the extraction: commands run in a single transaction, creating the output tables from the inputs
+# indexes lists (table, columns) pairs: indexes on inputs are created before the commands, indexes on outputs
+# after them, and every indexed or created table is analyzed
+Step = collections.namedtuple('Step', ['name', 'commands', 'inputs', 'outputs', 'checks', 'indexes'],
+                              defaults=[(), ()])
+
+CREATE_AS = re.compile(r'^\s*create\s+(temporary\s+)?table\s+\S+\s+as\s', re.IGNORECASE)
+
+CHUNK_SIZE = 50000  # rows fetched per round trip when streaming snapshots
+HOURS = [0, 24, 48]  # snapshot horizons, in hours after ICU admission
+
 
 class Database:
-  def __init__(self, hostname, username, password, dbname):
+  def __init__(self, hostname, username, password, dbname, pool_size=1):
     self._hostname = hostname
     self._username = username
     self._password = password
     self._dbname = dbname
 
     self.conn = self._connect()
+    self._pool = psycopg2.pool.ThreadedConnectionPool(1, pool_size,
+                                                      host=self._hostname,
+                                                      user=self._username,
+                                                      password=self._password,
+                                                      dbname=self._dbname,
+                                                      options='-c search_path=eicu_crd')
 
   def _connect(self) :
     conn = psycopg2.connect(host=self._hostname,
@@ -68,6 +152,20 @@ class Database:
   def get_conn(self):
     return self.conn
 
+  @contextlib.contextmanager
+  def pooled_conn(self):
+    """Borrow a connection from the pool, rolling back anything left uncommitted when it is returned."""
+    conn = self._pool.getconn()
+    try:
+      yield conn
+    finally:
+      conn.rollback()
+      self._pool.putconn(conn)
+
+  def close(self):
+    self._pool.closeall()
+    self.conn.close()
+
   def get_table_names(self, name):
       command = "select column_name from information_schema.columns " \
                 "where table_schema=\'eicu_crd\' and table_name=\'{}\';".format(name)
@@ -76,289 +174,664 @@ class Database:
       print('names:\n', names)
       return names
 
-  def do_query(self, command, fetch=True, commit=False) :
+  def do_query(self, command, fetch=True, commit=False, conn=None) :
       print('============= COMMAND: ==============\n'
             '{}\n============================================'.format(command))
-      cur = self.conn.cursor()
+      conn = self.conn if conn is None else conn
+      cur = conn.cursor()
       cur.execute(command)
       if commit:
-        self.conn.commit()
+        conn.commit()
       if fetch:
         rows = cur.fetchall()
         return rows
 
-
-def main():
-  cohort = 'pna_nonbacterial_cohort'
-  shortname = 'c2'
-  print('COHORT: {}\tSHORTNAME: {}'.format(cohort, shortname))
-
-  ## Connect to database
-  hostname = 'localhost'
-  username = 'postgres'
-  password = 'postgres'
-  dbname = 'eicu'
-
-  db = Database(hostname, username, password, dbname)
-  conn = db.get_conn()
-
-  ## Create outcome and feature dataframes
+  def table_signature(self, name):
+      """Identify the current version of a table, or None if it does not exist.
+
+      Recreating a table changes its oid and writing to it changes its size or its cumulative insert,
+      update and delete counts.
+      """
+      rows = self.do_query("select c.oid, pg_relation_size(c.oid), s.n_tup_ins, s.n_tup_upd, s.n_tup_del "
+                           "from pg_class c left join pg_stat_all_tables s on s.relid = c.oid "
+                           "where c.oid = to_regclass('{}');".format(name))
+      return rows[0] if rows else None
+
+  def create_indexes(self, indexes, conn=None):
+      """Create (table, columns) indexes if they do not exist yet and refresh the tables' statistics."""
+      for (table, columns) in indexes:
+        self.do_query('create index if not exists {table}_{name}_idx on {table} ({columns});'.format(
+                        table=table, name='_'.join(columns), columns=', '.join(columns)),
+                      fetch=False, commit=False, conn=conn)
+      for table in sorted(set(t for (t, _) in indexes)):
+        self.do_query('analyze {};'.format(table), fetch=False, commit=False, conn=conn)
+
+  def run_step(self, step, fingerprint=None, log_table=None, explain=False):
+      """Run the commands of a step in one transaction on a pooled connection, then print its checks.
+
+      If a log table is given, the step's fingerprint is recorded in the same transaction, so the log only
+      ever lists steps whose outputs were committed. With explain, CREATE TABLE ... AS commands are run
+      through EXPLAIN ANALYZE (which still creates the table) and a summary of their plans is returned
+      alongside the step's wall time.
+      """
+      print('Running step {}...'.format(step.name))
+      start = time.time()
+      plans = []
+      with self.pooled_conn() as conn:
+        self.create_indexes([(t, c) for (t, c) in step.indexes if t not in step.outputs], conn=conn)
+        for command in step.commands:
+          if explain and CREATE_AS.match(command):
+            rows = self.do_query('explain (analyze, buffers, format json) {}'.format(command), conn=conn)
+            plans.append(summarize_plan(rows[0][0][0]))
+          else:
+            self.do_query(command, fetch=False, commit=False, conn=conn)
+        self.create_indexes([(t, c) for (t, c) in step.indexes if t in step.outputs], conn=conn)
+        self.do_query('analyze {};'.format(', '.join(step.outputs)), fetch=False, commit=False, conn=conn)
+        if log_table is not None:
+          self.do_query("insert into {} (step, fingerprint, finished_at) values ('{}', '{}', now()) "
+                        "on conflict (step) do update set fingerprint=excluded.fingerprint, "
+                        "finished_at=excluded.finished_at;".format(log_table, step.name, fingerprint),
+                        fetch=False, commit=False, conn=conn)
+        conn.commit()
+        for command in step.checks:
+          print('{}: '.format(step.name), self.do_query(command, fetch=True, conn=conn))
+      print('Finished step {}.'.format(step.name))
+      return {'step': step.name, 'seconds': time.time() - start, 'plans': plans}
+
+  def iter_query(self, command, chunk_size=CHUNK_SIZE):
+      """Yield the result of a query as dataframes of at most chunk_size rows.
+
+      Uses a server-side (named) cursor so that only one chunk is held in client memory at a time.
+      """
+      print('============= STREAM: ==============\n'
+            '{}\n============================================'.format(command))
+      cur = self.conn.cursor(name='stream_cursor')
+      cur.itersize = chunk_size
+      cur.execute(command.strip().rstrip(';'))
+      try:
+        rows = cur.fetchmany(chunk_size)
+        names = [c[0] for c in cur.description]
+        while rows:
+          yield pd.DataFrame.from_records(rows, columns=names, coerce_float=True)
+          rows = cur.fetchmany(chunk_size)
+      finally:
+        cur.close()
+
+  def copy_to(self, command, fout, fmt='csv'):
+      """Stream the result of a query, or a whole table, into a file object with COPY ... TO STDOUT.
+
+      fmt is 'csv' (with a header row) or 'binary' (postgres binary copy format; fout must be opened in
+      binary mode). Rows are never materialized as python objects.
+      """
+      options = {'csv': 'format csv, header true', 'binary': 'format binary'}[fmt]
+      source = command.strip().rstrip(';')
+      if ' ' in source:
+        source = '({})'.format(source)
+      command = 'copy {} to stdout with ({});'.format(source, options)
+      print('============= COPY: ==============\n'
+            '{}\n============================================'.format(command))
+      cur = self.conn.cursor()
+      cur.copy_expert(command, fout)
+      cur.close()
+
+  def copy_to_file(self, command, fname, fmt='csv'):
+      with open(fname, 'wb') as fout:
+        self.copy_to(command, fout, fmt=fmt)
+
+  def read_copy(self, command, **kwargs):
+      """Read the result of a query into a dataframe through an in-memory csv COPY buffer."""
+      buf = io.BytesIO()
+      self.copy_to(command, buf, fmt='csv')
+      buf.seek(0)
+      kwargs.setdefault('float_precision', 'round_trip')
+      return pd.read_csv(buf, **kwargs)
+
+
+def summarize_plan(explained):
+  """Collect the sequential scans and the hashes or sorts that spilled to disk in an EXPLAIN ANALYZE plan."""
+  seq_scans = []
+  spills = []
+  nodes = [explained['Plan']]
+  while nodes:
+    node = nodes.pop()
+    nodes.extend(node.get('Plans', []))
+    if node['Node Type'] == 'Seq Scan':
+      seq_scans.append(node['Relation Name'])
+    if node.get('Hash Batches', 1) > 1 or node.get('HashAgg Batches', 1) > 1 \
+        or node.get('Sort Space Type') == 'Disk':
+      spills.append(node['Node Type'])
+  return {'ms': explained.get('Execution Time'), 'cost': explained['Plan']['Total Cost'],
+          'seq_scans': sorted(seq_scans), 'spills': spills}
+
+
+def print_step_report(reports, top=5):
+  """Print the slowest steps with the sequential scans and disk spills of their queries."""
+  print('============= SLOWEST STEPS: ==============')
+  for report in sorted(reports, key=lambda r: -r['seconds'])[:top]:
+    print('{}\t{:.1f}s'.format(report['step'], report['seconds']))
+    for plan in report['plans']:
+      print('\t{ms:.0f}ms, cost {cost:.0f}, seq scans: {seq_scans}, spills: {spills}'.format(**plan))
+  print('============================================')
+
+
+def iter_patient_frames(chunks, key='id'):
+  """Regroup a stream of id-ordered chunks so that no patient is split across two frames.
+
+  The rows of the last patient in each chunk are held back and prepended to the next chunk, so at most
+  one chunk plus one patient is held in memory.
+  """
+  pending = None
+  for chunk in chunks:
+    if pending is not None:
+      chunk = pd.concat([pending, chunk], ignore_index=True)
+    done = (chunk[key] != chunk[key].iloc[-1]).values
+    pending = chunk[~done]
+    if done.any():
+      yield chunk[done]
+  if pending is not None:
+    yield pending
+
+
+def stream_snapshots(db, query, cols=SNAPSHOT_COLS, chunk_size=CHUNK_SIZE):
+  """Yield the latest non-null value of each column per patient, a chunk of finished patients at a time.
+
+  Equivalent to ffill followed by last() within each patient, but the query must be ordered by
+  (id, t_offset) instead of being loaded into memory all at once.
+  """
+  for frame in iter_patient_frames(db.iter_query(query, chunk_size=chunk_size)):
+    yield frame.groupby('id', sort=False)[cols].last()
+
+
+def stream_horizon_snapshots(db, query, hours, cols=SNAPSHOT_COLS, chunk_size=CHUNK_SIZE):
+  """Yield {hours: snapshot} for every horizon from a single scan of the feature stream.
+
+  The query must be ordered by (id, t_offset), cover the largest horizon and have the times to event
+  shifted to each horizon (create_out with shift=0 and these horizons); each snapshot takes the
+  forward-filled row of the last observation at or before the horizon, with the times shifted in postgres,
+  so that they are the same values as in the sql and pandas snapshots.
+  """
+  days_cols = [c for c in cols if c.startswith('censor_or_')]
+  for frame in iter_patient_frames(db.iter_query(query, chunk_size=chunk_size)):
+    filled = frame.groupby('id', sort=False)[cols].ffill()
+    snapshots = {}
+    for h in hours:
+      ids = frame.loc[frame['t_offset'] <= h * 60, 'id']
+      last = ids.index[~ids.duplicated(keep='last')]
+      snapshots[h] = filled.loc[last].assign(**{c: frame.loc[last, '{}_{}h'.format(c, h)] for c in days_cols})
+    yield snapshots
+
+
+def _append_csv(pt, fout, n_rows):
+  pt = pt.reset_index(drop=True)
+  pt.index += n_rows
+  pt.to_csv(fout, header=(n_rows == 0))
+  return n_rows + len(pt)
+
+
+def write_snapshots(snapshots, fname):
+  """Write an iterable of snapshot frames to a single csv, numbering rows continuously."""
+  n_rows = 0
+  with open(fname, 'w') as fout:
+    for pt in snapshots:
+      n_rows = _append_csv(pt, fout, n_rows)
+  return n_rows
+
+
+def write_horizon_snapshots(snapshots, fnames):
+  """Write an iterable of {hours: snapshot} dicts to one csv per horizon."""
+  n_rows = {h: 0 for h in fnames}
+  with contextlib.ExitStack() as stack:
+    fouts = {h: stack.enter_context(open(f, 'w')) for (h, f) in fnames.items()}
+    for pts in snapshots:
+      for (h, pt) in pts.items():
+        n_rows[h] = _append_csv(pt, fouts[h], n_rows[h])
+  return n_rows
+
+
+def create_out(shortname, d=1, shift=None, horizons=()):
+  """Compute the corresponding features and outcomes associated with the day. 
+  (e.g. day 0 is 0 hours in, day 1 is 24 hours in, day 2 is 48 hours in, etc.)
+
+  Time to event is relative to the start of the day unless another shift (in days) is given. For each of
+  horizons (in hours), the times to event shifted by that horizon are added as {column}_{hours}h, computed
+  in postgres as for a snapshot of that horizon (see stream_horizon_snapshots).
+  """
+  lstr = -10000000000000000
+  gstr = d * 24 * 60
+  shift = d if shift is None else shift
+  days_cols = ['censor_or_deceased_days', 'censor_or_vasopressor_days', 'censor_or_ventilator_days']
+  shifted = ''.join(', ({col}-{day}) as {col}_{h}h'.format(col=c, day=horizon_days(h) + shift, h=h)
+                    for h in horizons for c in days_cols)
+  shifted_out = ''.join(', {}_{}h'.format(c, h) for h in horizons for c in days_cols)
+
+  query = "select coalesce(f.patientunitstayid, o.patientunitstayid) as id, f.*,  " \
+          "censor_or_deceased_days, " \
+          "deceased_indicator,censor_or_vasopressor_days, " \
+          "vasopressor_indicator,censor_or_ventilator_days, " \
+          "ventilator_indicator{shifted_out} " \
+          "from (select * from {shortname}_features where t_offset > {lstr} and t_offset <= {gstr}) f             " \
+          "inner join (select patientunitstayid, " \
+          "           (censor_or_deceased_days-{day}) as censor_or_deceased_days, " \
+          "           deceased_indicator,             " \
+          "           (censor_or_vasopressor_days-{day}) as censor_or_vasopressor_days, vasopressor_indicator,    " \
+          "           (censor_or_ventilator_days-{day}) as censor_or_ventilator_days, ventilator_indicator{shifted}  " \
+          "           from {shortname}_outs) o            " \
+          "on f.patientunitstayid = o.patientunitstayid " \
+          "order by id, t_offset;".format(shortname=shortname, lstr=lstr, gstr=gstr, day=shift, shifted=shifted,
+                                          shifted_out=shifted_out)
+  return query
+
+
+def create_snapshot_query(shortname, d=1, shift=None, cols=SNAPSHOT_COLS):
+  """Same snapshot as create_out followed by ffill/last, but reduced to one row per patient inside postgres.
+
+  The latest non-null value of each feature is taken with array_agg(... order by t_offset desc)
+  filtered on non-null values, which emulates last_value(... ignore nulls).
+  """
+  lstr = -10000000000000000
+  gstr = d * 24 * 60
+  shift = d if shift is None else shift
+  out_cols = [c for c in cols if c.startswith('censor_or_') or c.endswith('_indicator')]
+  feature_cols = [c for c in cols if c not in out_cols]
+
+  last_values = ', '.join('(array_agg(f.{col} order by f.t_offset desc) '
+                          'filter (where f.{col} is not null))[1] as {col}'.format(col=c) for c in feature_cols)
+  outcomes = ', '.join('o.{}'.format(c) for c in out_cols)
+  query = "select o.patientunitstayid as id, {last_values}, {outcomes} " \
+          "from (select * from {shortname}_features where t_offset > {lstr} and t_offset <= {gstr}) f " \
+          "inner join (select patientunitstayid, " \
+          "           (censor_or_deceased_days-{day}) as censor_or_deceased_days, " \
+          "           deceased_indicator, " \
+          "           (censor_or_vasopressor_days-{day}) as censor_or_vasopressor_days, vasopressor_indicator, " \
+          "           (censor_or_ventilator_days-{day}) as censor_or_ventilator_days, ventilator_indicator " \
+          "           from {shortname}_outs) o " \
+          "on f.patientunitstayid = o.patientunitstayid " \
+          "group by o.patientunitstayid, {outcomes} " \
+          "order by id;".format(last_values=last_values, outcomes=outcomes, shortname=shortname,
+                                lstr=lstr, gstr=gstr, day=shift)
+  return query
+
+
+def horizon_days(hours):
+  """Express a horizon in days, keeping whole days as integers so the generated sql is unchanged."""
+  return hours // 24 if hours % 24 == 0 else hours / 24.0
+
+
+def snapshot_fname(fname, hours):
+  if hours % 24 == 0:
+    return 'eicu_{}_{}_days_post_inicu.csv'.format(fname, hours // 24)
+  return 'eicu_{}_{}_hours_post_inicu.csv'.format(fname, hours)
+
+
+def build_steps(shortname, cohort):
+  """The CREATE TABLE steps of the extraction, listed in a valid sequential order.
+
+  Each step runs its commands in one transaction on one connection (so temporary tables stay visible
+  within the step) and prints the results of its checks afterwards.
+  """
+  steps = []
 
   # create outcome indicators
-  print("Creating indicators for outcomes mv and vp...")  
-  db.do_query("create temporary table {shortname}_treat0 as "
-              "select t.patientunitstayid as patientunitstayid, treatmentid, treatmentoffset, treatmentstring, "
-              "case when treatmentstring in {vpstr} then 1 else 0 end as vp, "
-              "case when treatmentstring in {mvstr} then 1 else 0 end as mv "
-              "from treatment as t "
-              "join {cohort} as c "
-              "on t.patientunitstayid = c.patientunitstayid;".format(shortname=shortname,
-                                                                     vpstr=VP_STRINGS,
-                                                                     mvstr=MV_STRINGS,
-                                                                     cohort=cohort), fetch=False, commit=False)
   outcome_tablename = '{}_treat'.format(shortname)
-  db.do_query("drop table if exists {};".format(outcome_tablename), fetch=False, commit=True)
-  db.do_query("CREATE TABLE {} AS "
-              "SELECT patientunitstayid, treatmentoffset, "
-              "MAX(vp) as vasopressor_indicator, "
-              "MAX(mv) as ventilator_indicator "
-              "FROM {}_treat0 t "
-              "GROUP BY t.patientunitstayid, treatmentoffset;".format(outcome_tablename, shortname), fetch=False, commit=False)
-
-  print('Some entries in {}: '.format(outcome_tablename),
-        db.do_query('select * from {} limit 2;'.format(outcome_tablename), fetch=True, commit=False))
+  steps.append(Step(
+    name='treat',
+    commands=[
+      'drop table if exists {}_treat0;'.format(shortname),
+      "create temporary table {shortname}_treat0 as "
+      "select t.patientunitstayid as patientunitstayid, treatmentid, treatmentoffset, treatmentstring, "
+      "case when treatmentstring in {vpstr} then 1 else 0 end as vp, "
+      "case when treatmentstring in {mvstr} then 1 else 0 end as mv "
+      "from treatment as t "
+      "join {cohort} as c "
+      "on t.patientunitstayid = c.patientunitstayid;".format(shortname=shortname,
+                                                             vpstr=VP_STRINGS,
+                                                             mvstr=MV_STRINGS,
+                                                             cohort=cohort),
+      "drop table if exists {};".format(outcome_tablename),
+      "CREATE TABLE {} AS "
+      "SELECT patientunitstayid, treatmentoffset, "
+      "MAX(vp) as vasopressor_indicator, "
+      "MAX(mv) as ventilator_indicator "
+      "FROM {}_treat0 t "
+      "GROUP BY t.patientunitstayid, treatmentoffset;".format(outcome_tablename, shortname)],
+    inputs=['treatment', cohort],
+    outputs=[outcome_tablename],
+    indexes=[('{}_treat'.format(shortname), ['patientunitstayid'])],
+    checks=['select * from {} limit 2;'.format(outcome_tablename)]))
 
   # join eICU patient table with our cohort table
-  db.do_query('drop table if exists {}_patient;'.format(shortname), fetch=False, commit=True)
-  db.do_query('CREATE TABLE {shortname}_patient AS '
-              'SELECT p.patientunitstayid as patientunitstayid, '
-              'patienthealthsystemstayid, hospitaladmitoffset, unitdischargeoffset '
-              'FROM patient p JOIN {cohort} c on p.patientunitstayid=c.patientunitstayid;'.format(shortname=shortname,
-                                                                                                  cohort=cohort),
-              fetch=False, commit=True)
-
-  print('Some patient rows: ',
-        db.do_query('select * from {}_patient limit 10;'.format(shortname), fetch=True))
-  print("Distinct patientunitstayid's: ",
-        db.do_query('select count(distinct(patientunitstayid)) from {shortname}_patient;'.format(shortname=shortname), fetch=True))
-  print("Distinct patienthealthsystemstayid's: ",
-        db.do_query("select count(distinct(patienthealthsystemstayid)) from {shortname}_patient;".format(shortname=shortname), fetch=True))
-  print('Rows in {}_patient: '.format(shortname),
-        db.do_query('select count(*) from {shortname}_patient;'.format(shortname=shortname), fetch=True))
+  steps.append(Step(
+    name='patient',
+    commands=[
+      'drop table if exists {}_patient;'.format(shortname),
+      'CREATE TABLE {shortname}_patient AS '
+      'SELECT p.patientunitstayid as patientunitstayid, '
+      'patienthealthsystemstayid, hospitaladmitoffset, unitdischargeoffset '
+      'FROM patient p JOIN {cohort} c on p.patientunitstayid=c.patientunitstayid;'.format(shortname=shortname,
+                                                                                          cohort=cohort)],
+    inputs=['patient', cohort],
+    outputs=['{}_patient'.format(shortname)],
+    indexes=[('{}_patient'.format(shortname), ['patientunitstayid']),
+             ('{}_patient'.format(shortname), ['patienthealthsystemstayid'])],
+    checks=['select * from {}_patient limit 10;'.format(shortname),
+            'select count(distinct(patientunitstayid)) from {shortname}_patient;'.format(shortname=shortname),
+            'select count(distinct(patienthealthsystemstayid)) from {shortname}_patient;'.format(shortname=shortname),
+            'select count(*) from {shortname}_patient;'.format(shortname=shortname)]))
 
   # extract patient death
-  db.do_query('drop table if exists {}_death0;'.format(shortname), fetch=False, commit=True)
-
-  command = "create table {shortname}_death0 " \
-            "as select coalesce(r.patientunitstayid, c.patientunitstayid) as patientunitstayid, " \
-            "r.actualicumortality " \
-            "from apachepatientresult r " \
-            "join {cohort} c on r.patientunitstayid=c.patientunitstayid " \
-            "where r.apacheversion like \'%IVa%\';".format(shortname=shortname, cohort=cohort)
-  db.do_query(command, fetch=False, commit=True)
-  db.do_query('drop table if exists {}_death;'.format(shortname), fetch=False, commit=True)
-
-  command = "create table {shortname}_death          " \
-            "as select patientunitstayid,           " \
-            "case              " \
-            "when r.actualicumortality like \'%ALIVE%\' then 0 else 1           " \
-            "end as deceased_indicator           " \
-            "from {shortname}_death0 r;".format(shortname=shortname)
-  db.do_query(command, fetch=False, commit=True)
-  print(db.do_query('select count(*) from {}_death;'.format(shortname), fetch=True))
-  print(db.do_query('select count(distinct(patientunitstayid)) from {}_death;'.format(shortname), fetch=True))
-
-  db.do_query('drop table if exists {}_patientdeath0;'.format(shortname), fetch=False, commit=True)
-
-  command = "create table {shortname}_patientdeath0 " \
-            "as select coalesce(p.patientunitstayid, c.patientunitstayid) as patientunitstayid, " \
-            "case " \
-            "when lower(p.unitDischargeStatus) like '%expired%' then 1 else 0 " \
-            "end as deceased_indicator " \
-            "from patient p " \
-            "join {cohort} c on p.patientunitstayid=c.patientunitstayid;".format(shortname=shortname, cohort=cohort)
-  db.do_query(command, fetch=False, commit=True)
-  db.do_query('drop table if exists {}_patientdeath;'.format(shortname), fetch=False, commit=True)
-
-  command = "create table {shortname}_patientdeath          " \
-            "as select patientunitstayid,           " \
-            "MAX(deceased_indicator) as deceased_indicator           " \
-            "from {shortname}_patientdeath0 group by patientunitstayid;".format(shortname=shortname)
-  db.do_query(command, fetch=False, commit=True)
+  steps.append(Step(
+    name='death',
+    commands=[
+      'drop table if exists {}_death0;'.format(shortname),
+      "create table {shortname}_death0 "
+      "as select coalesce(r.patientunitstayid, c.patientunitstayid) as patientunitstayid, "
+      "r.actualicumortality "
+      "from apachepatientresult r "
+      "join {cohort} c on r.patientunitstayid=c.patientunitstayid "
+      "where r.apacheversion like \'%IVa%\';".format(shortname=shortname, cohort=cohort),
+      'drop table if exists {}_death;'.format(shortname),
+      "create table {shortname}_death          "
+      "as select patientunitstayid,           "
+      "case              "
+      "when r.actualicumortality like \'%ALIVE%\' then 0 else 1           "
+      "end as deceased_indicator           "
+      "from {shortname}_death0 r;".format(shortname=shortname)],
+    inputs=['apachepatientresult', cohort],
+    outputs=['{}_death0'.format(shortname), '{}_death'.format(shortname)],
+    checks=['select count(*) from {}_death;'.format(shortname),
+            'select count(distinct(patientunitstayid)) from {}_death;'.format(shortname)]))
+
+  steps.append(Step(
+    name='patientdeath',
+    commands=[
+      'drop table if exists {}_patientdeath0;'.format(shortname),
+      "create table {shortname}_patientdeath0 "
+      "as select coalesce(p.patientunitstayid, c.patientunitstayid) as patientunitstayid, "
+      "case "
+      "when lower(p.unitDischargeStatus) like '%expired%' then 1 else 0 "
+      "end as deceased_indicator "
+      "from patient p "
+      "join {cohort} c on p.patientunitstayid=c.patientunitstayid;".format(shortname=shortname, cohort=cohort),
+      'drop table if exists {}_patientdeath;'.format(shortname),
+      "create table {shortname}_patientdeath          "
+      "as select patientunitstayid,           "
+      "MAX(deceased_indicator) as deceased_indicator           "
+      "from {shortname}_patientdeath0 group by patientunitstayid;".format(shortname=shortname)],
+    inputs=['patient', cohort],
+    outputs=['{}_patientdeath0'.format(shortname), '{}_patientdeath'.format(shortname)],
+    indexes=[('{}_patientdeath'.format(shortname), ['patientunitstayid'])]))
 
   # extract 1st ICU visits
-  db.do_query('drop table if exists {shortname}_firstpatientunitstayid;'.format(shortname=shortname),
-              fetch=False, commit=True)
-  command = 'create table {shortname}_firstpatientunitstayid as select patientunitstayid from ' \
-            '(select patienthealthsystemstayid, ' \
-            'max(hospitaladmitoffset) as hospitaladmitoffset ' \
-            'from {shortname}_patient ' \
-            'group by patienthealthsystemstayid) t ' \
-            'join {shortname}_patient c ' \
-            'on t.patienthealthsystemstayid=c.patienthealthsystemstayid' \
-            ' and t.hospitaladmitoffset=c.hospitaladmitoffset;'.format(shortname=shortname)
-  db.do_query(command, fetch=False, commit=True)
-  print('Count of firstpatientunitstayids: ',
-        db.do_query('select count(*) from {shortname}_firstpatientunitstayid'.format(shortname=shortname)))
+  steps.append(Step(
+    name='firstpatientunitstayid',
+    commands=[
+      'drop table if exists {shortname}_firstpatientunitstayid;'.format(shortname=shortname),
+      'create table {shortname}_firstpatientunitstayid as select patientunitstayid from '
+      '(select patienthealthsystemstayid, '
+      'max(hospitaladmitoffset) as hospitaladmitoffset '
+      'from {shortname}_patient '
+      'group by patienthealthsystemstayid) t '
+      'join {shortname}_patient c '
+      'on t.patienthealthsystemstayid=c.patienthealthsystemstayid'
+      ' and t.hospitaladmitoffset=c.hospitaladmitoffset;'.format(shortname=shortname)],
+    inputs=['{}_patient'.format(shortname)],
+    outputs=['{}_firstpatientunitstayid'.format(shortname)],
+    indexes=[('{}_firstpatientunitstayid'.format(shortname), ['patientunitstayid'])],
+    checks=['select count(*) from {shortname}_firstpatientunitstayid'.format(shortname=shortname)]))
 
   # join together the feature tables
-  db.do_query('drop table if exists {}_features0;'.format(shortname), fetch=False, commit=True)
-  db.do_query("CREATE table {shortname}_features0 as "
-              "SELECT COALESCE(d.patientunitstayid, l.patientunitstayid, v.patientunitstayid, "
-              "n.patientunitstayid, c.patientunitstayid, a.patientunitstayid) as patientunitstayid, "
-              "COALESCE(l.t_offset, v.t_offset, n.t_offset, c.t_offset, a.t_offset) as t_offset, "
-              "COALESCE(l.temperature, v.temperature, n.temperature) as temperature, "
-              "coalesce(cast(n.bp_systolic as float), v.bp_systolic) as bp_systolic, "
-              "coalesce(cast(n.bp_diastolic as float), v.bp_diastolic) as bp_diastolic, "
-              "coalesce(cast(n.bp_mean as float), v.bp_mean) as bp_mean_arterial, "
-              "rbcs, wbc, platelets, hemoglobin, hct, rdw, mcv, mch, mchc, "
-              "neutrophils, lymphocytes, monocytes, eosinophils, basophils, "
-              "bun, ph, sodium, glucose, pao2, fio2, ldh, crp, direct_bilirubin, total_bilirubin, total_protein, "
-              "albumin, ferritin, pt, ptt, fibrinogen, ast, alt, creatinine, troponin, alkaline_phosphatase, "
-              "bands, bicarbonate, calcium, chloride, potassium, "
-              "d.gender, d.age, d.ethnicity, "
-              "v.heart_rate, v.sao2, "
-              "COALESCE(CAST(n.respiratory_rate AS FLOAT), CAST(v.respiratory_rate AS FLOAT)) as respiratory_rate, " 
-              "COALESCE(n.gcs, n.gcs2) as gcs, "
-              "c.smoking, "
-              "COALESCE(c.pleural_effusion, 0) as pleural_effusion, "
-              "COALESCE(a.orientation,  n.gcs_orientation) as orientation, "
-              "d.nursing_home as nursing_home, "
-              "r.chest_xray as chest_xray "
-              "FROM {shortname}_demographics d "
-              "FULL JOIN {shortname}_labs l "
-              "ON d.patientunitstayid = l.patientunitstayid "
-              "FULL JOIN {shortname}_vitals v "
-              "ON l.t_offset= v.t_offset and v.patientunitstayid = l.patientunitstayid "
-              "FULL JOIN {shortname}_nurse_charting n "
-              "ON n.t_offset= v.t_offset and v.patientunitstayid = n.patientunitstayid "
-              "FULL JOIN {shortname}_comorbidities c "
-              "ON c.t_offset= n.t_offset and c.patientunitstayid = n.patientunitstayid "
-              "FULL JOIN {shortname}_amt a "
-              "ON a.t_offset= c.t_offset and a.patientunitstayid=c.patientunitstayid "
-              "FULL JOIN {shortname}_xray r "
-              "ON r.t_offset= a.t_offset and r.patientunitstayid=a.patientunitstayid "
-              "ORDER BY patientunitstayid, t_offset;".format(shortname=shortname),
-              fetch=False, commit=True)
-
-  print('features0: ',
-        db.do_query('select * from {}_features0 limit 2;'.format(shortname), fetch=True))
-  print(db.do_query('select count(distinct(patientunitstayid)) from {}_features0;'.format(shortname), fetch=True))
-  print('finishing merging features.')
-
-  db.do_query('drop table if exists {}_features;'.format(shortname), fetch=False, commit=True)
+  steps.append(Step(
+    name='features0',
+    commands=[
+      'drop table if exists {}_features0;'.format(shortname),
+      FEATURES0_QUERY.format(shortname=shortname)],
+    inputs=['{}_{}'.format(shortname, t) for t in FEATURE_TABLES],
+    outputs=['{}_features0'.format(shortname)],
+    indexes=[('{}_{}'.format(shortname, t), ['patientunitstayid', 't_offset']) for t in FEATURE_TABLES[1:]] +
+            [('{}_demographics'.format(shortname), ['patientunitstayid']),
+             ('{}_features0'.format(shortname), ['patientunitstayid'])],
+    checks=['select * from {}_features0 limit 2;'.format(shortname),
+            'select count(distinct(patientunitstayid)) from {}_features0;'.format(shortname)]))
 
   # create table of first patient ICU stays joined with the corresponding features
-  db.do_query("create table {shortname}_features as "
-              "select f.* from {shortname}_features0 f "
-              "join {shortname}_firstpatientunitstayid p on p.patientunitstayid=f.patientunitstayid;".format(shortname=shortname),
-              fetch=False, commit=True)
-  print(db.do_query('select count(distinct(patientunitstayid)) from {}_features'.format(shortname), fetch=True))
-  print(db.do_query('select * from {}_features limit(5);'.format(shortname), fetch=True))
-  
-  a = db.do_query('drop table if exists {}_outs0;'.format(shortname), fetch=False, commit=True)
-  db.do_query("create table {shortname}_outs0           "
-              "as select           "
-              "coalesce(t.patientunitstayid, p.patientunitstayid, d.patientunitstayid) as patientunitstayid,           "
-              "t.vasopressor_indicator, t.ventilator_indicator,           "
-              "p.unitdischargeoffset/1440.0 as censor_or_deceased_days,           "
-              "d.deceased_indicator,           "
-              "case               "
-              "when vasopressor_indicator=1 then t.treatmentoffset/1440.0 else p.unitdischargeoffset/1440.0           "
-              "end as censor_or_vasopressor_days,           "
-              "case               "
-              "when ventilator_indicator=1 then t.treatmentoffset/1440.0 else p.unitdischargeoffset/1440.0           "
-              "end as censor_or_ventilator_days           "
-              "from {shortname}_treat as t           "
-              "full join {shortname}_patient p on t.patientunitstayid=p.patientunitstayid           "
-              "full join {shortname}_patientdeath d on p.patientunitstayid=d.patientunitstayid;".format(shortname=shortname),
-              fetch=False, commit=True)
+  steps.append(Step(
+    name='features',
+    commands=[
+      'drop table if exists {}_features;'.format(shortname),
+      "create table {shortname}_features as "
+      "select f.* from {shortname}_features0 f "
+      "join {shortname}_firstpatientunitstayid p on p.patientunitstayid=f.patientunitstayid;".format(shortname=shortname)],
+    inputs=['{}_features0'.format(shortname), '{}_firstpatientunitstayid'.format(shortname)],
+    outputs=['{}_features'.format(shortname)],
+    indexes=[('{}_features'.format(shortname), ['patientunitstayid', 't_offset'])],
+    checks=['select count(distinct(patientunitstayid)) from {}_features'.format(shortname),
+            'select * from {}_features limit(5);'.format(shortname)]))
+
+  steps.append(Step(
+    name='outs0',
+    commands=[
+      'drop table if exists {}_outs0;'.format(shortname),
+      "create table {shortname}_outs0           "
+      "as select           "
+      "coalesce(t.patientunitstayid, p.patientunitstayid, d.patientunitstayid) as patientunitstayid,           "
+      "t.vasopressor_indicator, t.ventilator_indicator,           "
+      "p.unitdischargeoffset/1440.0 as censor_or_deceased_days,           "
+      "d.deceased_indicator,           "
+      "case               "
+      "when vasopressor_indicator=1 then t.treatmentoffset/1440.0 else p.unitdischargeoffset/1440.0           "
+      "end as censor_or_vasopressor_days,           "
+      "case               "
+      "when ventilator_indicator=1 then t.treatmentoffset/1440.0 else p.unitdischargeoffset/1440.0           "
+      "end as censor_or_ventilator_days           "
+      "from {shortname}_treat as t           "
+      "full join {shortname}_patient p on t.patientunitstayid=p.patientunitstayid           "
+      "full join {shortname}_patientdeath d on p.patientunitstayid=d.patientunitstayid;".format(shortname=shortname)],
+    inputs=['{}_treat'.format(shortname), '{}_patient'.format(shortname), '{}_patientdeath'.format(shortname)],
+    outputs=['{}_outs0'.format(shortname)]))
 
   # aggregate the time to events and event indicators
-  db.do_query('drop table if exists {}_outs00;'.format(shortname), fetch=False, commit=True)
-  db.do_query("create table {shortname}_outs00           "
-              "as select patientunitstayid,           "
-              "min(censor_or_deceased_days) as censor_or_deceased_days,           "
-              "max(deceased_indicator) as deceased_indicator,           "
-              "min(censor_or_vasopressor_days) as censor_or_vasopressor_days,           "
-              "max(vasopressor_indicator) as vasopressor_indicator,           "
-              "min(censor_or_ventilator_days) as censor_or_ventilator_days,           "
-              "max(ventilator_indicator) as ventilator_indicator           "
-              "from {shortname}_outs0           "
-              "group by patientunitstayid;".format(shortname=shortname), fetch=False, commit=True)
-
-  db.do_query('select count(*) from {}_outs00;'.format(shortname), fetch=True)
-  db.do_query('select count(distinct(patientunitstayid)) from {}_outs00;'.format(shortname), fetch=True)
-
-  db.do_query('update {}_outs00 set ventilator_indicator=0 where ventilator_indicator is null;'.format(shortname), fetch=False, commit=True)
-  db.do_query('update {}_outs00 set vasopressor_indicator=0 where vasopressor_indicator is null;'.format(shortname), fetch=False, commit=True)
+  steps.append(Step(
+    name='outs00',
+    commands=[
+      'drop table if exists {}_outs00;'.format(shortname),
+      "create table {shortname}_outs00           "
+      "as select patientunitstayid,           "
+      "min(censor_or_deceased_days) as censor_or_deceased_days,           "
+      "max(deceased_indicator) as deceased_indicator,           "
+      "min(censor_or_vasopressor_days) as censor_or_vasopressor_days,           "
+      "max(vasopressor_indicator) as vasopressor_indicator,           "
+      "min(censor_or_ventilator_days) as censor_or_ventilator_days,           "
+      "max(ventilator_indicator) as ventilator_indicator           "
+      "from {shortname}_outs0           "
+      "group by patientunitstayid;".format(shortname=shortname),
+      'update {}_outs00 set ventilator_indicator=0 where ventilator_indicator is null;'.format(shortname),
+      'update {}_outs00 set vasopressor_indicator=0 where vasopressor_indicator is null;'.format(shortname)],
+    inputs=['{}_outs0'.format(shortname)],
+    outputs=['{}_outs00'.format(shortname)],
+    indexes=[('{}_outs00'.format(shortname), ['patientunitstayid'])],
+    checks=['select count(*) from {}_outs00;'.format(shortname),
+            'select count(distinct(patientunitstayid)) from {}_outs00;'.format(shortname)]))
 
   # get the outcomes associated with first patient stays
-  db.do_query('drop table if exists {}_outs;'.format(shortname), fetch=False, commit=True)
-  db.do_query("create table {shortname}_outs as           "
-              "select o.* from {shortname}_outs00 o           "
-              "join {shortname}_firstpatientunitstayid p on p.patientunitstayid=o.patientunitstayid;".format(shortname=shortname), fetch=False, commit=True)
-  db.do_query('select count(*) from {}_outs;'.format(shortname), fetch=True)
-  db.do_query('select * from {}_outs limit(5);'.format(shortname), fetch=True)
-
-  def create_out(d=1):
-    """Compute the corresponding features and outcomes associated with the day. 
-    (e.g. day 0 is 0 hours in, day 1 is 24 hours in, day 2 is 48 hours in, etc.)
-    """
-    lstr = -10000000000000000
-    gstr = d * 24 * 60
-
-    query = "select coalesce(f.patientunitstayid, o.patientunitstayid) as id, f.*,  " \
-            "censor_or_deceased_days, " \
-            "deceased_indicator,censor_or_vasopressor_days, " \
-            "vasopressor_indicator,censor_or_ventilator_days, " \
-            "ventilator_indicator " \
-            "from (select * from {shortname}_features where t_offset > {lstr} and t_offset <= {gstr}) f             " \
-            "inner join (select patientunitstayid, " \
-            "           (censor_or_deceased_days-{day}) as censor_or_deceased_days, " \
-            "           deceased_indicator,             " \
-            "           (censor_or_vasopressor_days-{day}) as censor_or_vasopressor_days, vasopressor_indicator,    " \
-            "           (censor_or_ventilator_days-{day}) as censor_or_ventilator_days, ventilator_indicator  " \
-            "           from {shortname}_outs) o            " \
-            "on f.patientunitstayid = o.patientunitstayid;".format(shortname=shortname, lstr=lstr, gstr=gstr, day=d)
-    return query
-
-  times = [0, 1, 2]
-  pts = []
-  for d in times:
-    print('Creating csvs for day {}...'.format(d))
-    print('before query')
-    query = create_out(d)
-    df = pd.read_sql(query, conn)
-    print('df size:', df.shape)
-    print('unique patientunitstayid:', len(df.id.unique()))
-
-    cols = ['rbcs', 'wbc', 'platelets',
-            'hemoglobin', 'hct', 'rdw', 'mcv', 'mch', 'mchc', 'neutrophils',
-            'lymphocytes', 'monocytes', 'eosinophils', 'basophils', 'bun',
-            'temperature', 'ph', 'sodium', 'glucose', 'pao2', 'fio2', 'ldh', 'crp',
-            'direct_bilirubin', 'total_bilirubin', 'total_protein', 'albumin',
-            'ferritin', 'pt', 'ptt', 'fibrinogen', 'ast', 'alt', 'creatinine',
-            'troponin', 'alkaline_phosphatase', 'bands', 'bicarbonate', 'calcium',
-            'chloride', 'potassium', 'gender', 'age', 'ethnicity',
-            'heart_rate', 'sao2', 'gcs', 'respiratory_rate',
-            'bp_systolic', 'bp_diastolic', 'bp_mean_arterial', 'smoking', 'pleural_effusion',
-            'nursing_home', 'chest_xray', 
-            'orientation', 'censor_or_deceased_days', 'deceased_indicator',
-            'censor_or_vasopressor_days', 'vasopressor_indicator',
-            'censor_or_ventilator_days', 'ventilator_indicator']
-    pt = df
-    pt.update(pt.groupby('id')[cols].ffill())
-    pt = pt.groupby('id').last().reset_index()
-    print('unique patientunitstayid:', len(pt.id.unique()))
-    pt = pt[cols]
-    fname = 'anypna'
-    pt.to_csv('eicu_{}_{}_days_post_inicu.csv'.format(fname, d))
-    print('saved csv for d{}'.format(d))
-    print('pt size:', pt.shape)
-  conn.close()
+  steps.append(Step(
+    name='outs',
+    commands=[
+      'drop table if exists {}_outs;'.format(shortname),
+      "create table {shortname}_outs as           "
+      "select o.* from {shortname}_outs00 o           "
+      "join {shortname}_firstpatientunitstayid p on p.patientunitstayid=o.patientunitstayid;".format(shortname=shortname)],
+    inputs=['{}_outs00'.format(shortname), '{}_firstpatientunitstayid'.format(shortname)],
+    outputs=['{}_outs'.format(shortname)],
+    indexes=[('{}_outs'.format(shortname), ['patientunitstayid'])],
+    checks=['select count(*) from {}_outs;'.format(shortname),
+            'select * from {}_outs limit(5);'.format(shortname)]))
+  return steps
+
+
+def fingerprint_steps(db, steps):
+  """Fingerprint each step from its sql text and the versions of its inputs.
+
+  Inputs built by an earlier step contribute that step's fingerprint, other tables their signature,
+  so a change anywhere upstream changes the fingerprint of every step downstream of it. Steps must be
+  listed in a valid sequential order.
+  """
+  producers = {t: s.name for s in steps for t in s.outputs}
+  fingerprints = {}
+  for step in steps:
+    h = hashlib.sha1()
+    for command in step.commands:
+      h.update(command.encode('utf-8'))
+    h.update(repr(sorted(step.indexes)).encode('utf-8'))
+    for t in sorted(step.inputs):
+      signature = fingerprints[producers[t]] if t in producers else db.table_signature(t)
+      h.update('{}={}'.format(t, signature).encode('utf-8'))
+    fingerprints[step.name] = h.hexdigest()
+  return fingerprints
+
+
+def get_current_steps(db, steps, fingerprints, log_table):
+  """Names of the steps whose logged fingerprint is unchanged and whose outputs still exist."""
+  logged = dict(db.do_query('select step, fingerprint from {};'.format(log_table)))
+  return set(s.name for s in steps
+             if logged.get(s.name) == fingerprints[s.name]
+             and all(db.table_signature(t) is not None for t in s.outputs))
+
+
+def run_steps(db, steps, n_workers=1, log_table=None, incremental=False, explain=False):
+  """Run the steps on up to n_workers pooled connections.
+
+  A step is started as soon as every step producing one of its inputs has finished, so the wall time is
+  bounded by the critical path rather than the sum of all steps. With one worker the steps run in the
+  order they are listed.
+
+  With a log table, the fingerprint of every finished step is recorded there; in incremental mode, steps
+  whose fingerprint matches the log are skipped, which also resumes an interrupted run after the last
+  committed step. Returns the run_step report of every step that ran.
+  """
+  fingerprints = {s.name: None for s in steps}
+  done = set()
+  if log_table is not None:
+    db.do_query('create table if not exists {} '
+                '(step text primary key, fingerprint text, finished_at timestamptz);'.format(log_table),
+                fetch=False, commit=True)
+    fingerprints = fingerprint_steps(db, steps)
+    if incremental:
+      done = get_current_steps(db, steps, fingerprints, log_table)
+      for step in steps:
+        if step.name in done:
+          print('Skipping step {} (up to date).'.format(step.name))
+
+  producers = {t: s.name for s in steps for t in s.outputs}
+  deps = {s.name: set(producers[t] for t in s.inputs if t in producers) - {s.name} for s in steps}
+  pending = [s for s in steps if s.name not in done]
+  running = {}
+  reports = []
+  with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+    while pending or running:
+      for step in [s for s in pending if deps[s.name] <= done]:
+        pending.remove(step)
+        running[executor.submit(db.run_step, step, fingerprints[step.name], log_table, explain)] = step
+      if not running:
+        raise ValueError('steps with unsatisfiable dependencies: {}'.format([s.name for s in pending]))
+      finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in finished:
+        step = running.pop(future)
+        reports.append(future.result())
+        done.add(step.name)
+  return reports
+
+
+def main(snapshot='horizons', hours=HOURS, chunk_size=CHUNK_SIZE, export=(), export_format='csv', n_workers=4,
+         incremental=False, explain=False):
+  cohort = 'pna_nonbacterial_cohort'
+  shortname = 'c2'
+  print('COHORT: {}\tSHORTNAME: {}'.format(cohort, shortname))
+
+  ## Connect to database
+  hostname = 'localhost'
+  username = 'postgres'
+  password = 'postgres'
+  dbname = 'eicu'
+
+  db = Database(hostname, username, password, dbname, pool_size=n_workers)
+  conn = db.get_conn()
+
+  reports = run_steps(db, build_steps(shortname, cohort), n_workers=n_workers,
+                      log_table='{}_step_log'.format(shortname), incremental=incremental, explain=explain)
+  if explain:
+    print_step_report(reports)
+
+  fname = 'anypna'
+  if snapshot == 'horizons':
+    print('Creating csvs for hours {}...'.format(hours))
+    query = create_out(shortname, d=horizon_days(max(hours)), shift=0, horizons=hours)
+    fnames = {h: snapshot_fname(fname, h) for h in hours}
+    n_rows = write_horizon_snapshots(stream_horizon_snapshots(db, query, hours, chunk_size=chunk_size), fnames)
+    for h in hours:
+      print('saved {} ({} rows)'.format(fnames[h], n_rows[h]))
+  else:
+    for h in hours:
+      d = horizon_days(h)
+      print('Creating csvs for day {}...'.format(d))
+      print('before query')
+      query = create_out(shortname, d)
+      out_fname = snapshot_fname(fname, h)
+      if snapshot == 'stream':
+        n_rows = write_snapshots(stream_snapshots(db, query, chunk_size=chunk_size), out_fname)
+        print('saved csv for d{}'.format(d))
+        print('pt size:', (n_rows, len(SNAPSHOT_COLS)))
+        continue
+      if snapshot == 'sql':
+        pt = db.read_copy(create_snapshot_query(shortname, d))[SNAPSHOT_COLS]
+        pt.to_csv(out_fname)
+        print('saved csv for d{}'.format(d))
+        print('pt size:', pt.shape)
+        continue
+
+      df = pd.read_sql(query, conn)
+      print('df size:', df.shape)
+      print('unique patientunitstayid:', len(df.id.unique()))
+
+      cols = SNAPSHOT_COLS
+      pt = df
+      pt.update(pt.groupby('id')[cols].ffill())
+      pt = pt.groupby('id').last().reset_index()
+      print('unique patientunitstayid:', len(pt.id.unique()))
+      pt = pt[cols]
+      pt.to_csv(out_fname)
+      print('saved csv for d{}'.format(d))
+      print('pt size:', pt.shape)
+
+  # dump intermediate tables as they are, e.g. for analysis outside of this script
+  for name in export:
+    table = '{}_{}'.format(shortname, name)
+    out_fname = '{}.{}'.format(table, 'csv' if export_format == 'csv' else 'bin')
+    db.copy_to_file(table, out_fname, fmt=export_format)
+    print('exported {} to {}'.format(table, out_fname))
+  db.close()
 
 
 if __name__ == '__main__':
-  main()
+  parser = argparse.ArgumentParser(description='extract eicu cohort csvs')
+  parser.add_argument('--snapshot', default='horizons', choices=['horizons', 'stream', 'sql', 'pandas'], action='store',
+                      help='horizons: build every horizon from a single patient-ordered scan; '
+                           'stream: one streamed scan per horizon; '
+                           'sql: reduce each horizon to one row per patient inside postgres; '
+                           'pandas: load each horizon into memory and groupby')
+  parser.add_argument('--hours', type=int, nargs='+', default=HOURS, action='store',
+                      help='snapshot horizons in hours after ICU admission (e.g. 0 6 12 ... 72)')
+  parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE, action='store')
+  parser.add_argument('--workers', type=int, default=4, action='store',
+                      help='number of connections used to build independent tables concurrently')
+  parser.add_argument('--incremental', action='store_true',
+                      help='skip steps whose sql and inputs are unchanged since they last completed')
+  parser.add_argument('--explain', action='store_true',
+                      help='run the table builds through EXPLAIN ANALYZE and report the slowest steps')
+  parser.add_argument('--export', nargs='*', default=[], action='store',
+                      help='intermediate tables to dump with COPY, without the shortname prefix (e.g. features outs)')
+  parser.add_argument('--export_format', default='csv', choices=['csv', 'binary'], action='store')
+  args = parser.parse_args()
+  main(snapshot=args.snapshot, hours=sorted(args.hours), chunk_size=args.chunk_size,
+       export=args.export, export_format=args.export_format, n_workers=args.workers,
+       incremental=args.incremental, explain=args.explain)
   
\ No newline at end of file
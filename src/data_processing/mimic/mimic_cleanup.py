@@ -2,42 +2,117 @@
 
 * converts numerical features to numeric types
 * drops excluded features
+
+What happens to each column is declared in COLUMN_SCHEMA, and applied by the csv parser as it reads the file:
+dropped columns are never parsed, numeric and binary columns are parsed by converters that turn anything
+that is not a number (e.g. '<0.1') into nan, and categorical columns are read as strings. The six files are
+cleaned in parallel, one process per file.
+
+A parquet copy of each cleaned file is written next to it when pyarrow is installed.
 """
 
+import argparse
+import multiprocessing
+import os
+
+import numpy as np
 import pandas as pd
 
-out_dir = '../../data/mimic/mimic_cleaned/'
-for in_fname in ['../../data/mimic/anypna/cleaner_mimic_anypna_timeline_flfv_{}_days_post_inicu.csv',
-                 '../../data/mimic/anypna/cleaner_mimic_viralpna_timeline_flfv_{}_days_post_inicu.csv']:
-  for i in range(3):
-    fname = in_fname.format(i)
-    df = pd.read_csv(fname, delimiter='|')
-    df['cancer'] = df['cancer'].astype(int)
-    df['deceased_indicator'] = df['deceased_indicator'].astype(int)
-    for col in df.columns:
-      if col in ['gender', 'ethnicity']:
-        continue
-      elif col in ['rbcs', 'wbc', 'platelets',
-                   'hemoglobin', 'hct', 'rdw', 'mcv', 'mch', 'mchc', 'neutrophils',
-                   'lymphocytes', 'monocytes', 'eosinophils', 'basophils', 'bun',
-                   'temperature', 'ph', 'sodium', 'glucose', 'pao2', 'fio2', 'ldh', 'crp',
-                   'direct_bilirubin', 'total_bilirubin', 'total_protein', 'albumin',
-                   'ferritin', 'pt', 'ptt', 'fibrinogen', 'ast', 'alt', 'creatinine',
-                   'troponin', 'alkaline_phosphatase', 'bands', 'bicarbonate', 'calcium',
-                   'chloride', 'potassium', 'heart_rate', 'sao2', 'gcs', 'respiratory_rate',
-                   'bp_systolic', 'bp_diastolic', 'bp_mean_arterial', 'orientation',
-                    'censor_or_deceased_days', 'censor_or_vasopressor_days', 'censor_or_ventilator_days',
-                   'd-dimer']:
-        df[col] = pd.to_numeric(df[col], errors='coerce')  # replace strings with nans
-      elif col in ['smoking', 'cancer', 'liver_disease', 'chf', 'renal_failure', 'pleural_effusion',
-                   'deceased_indicator', 'vasopressor_indicator', 'ventilator_indicator']:
-        df[col] = pd.to_numeric(df[col], errors='coerce')  # replace strings with nans
-    df = df.drop('hosp_id', axis=1)
-    df = df.drop('cancer', axis=1)
-    df = df.drop('liver_disease', axis=1)
-    df = df.drop('chf', axis=1)
-    df = df.drop('renal_failure', axis=1)
-    df['gender'] = df['gender'].replace({'gender:m': 'Male', 'gender:f': 'Female'})
-    df.reset_index()
-    df.index.name = 'X'
-    df.to_csv(out_dir + in_fname.split('/')[-1].format(i), index=True, sep='|')
+try:
+  import pyarrow
+except ImportError:  # only write csv
+  pyarrow = None
+
+
+NUMERIC = 'numeric'
+BINARY = 'binary'
+CATEGORICAL = 'categorical'
+DROP = 'drop'
+
+NUMERIC_COLS = ['rbcs', 'wbc', 'platelets',
+                'hemoglobin', 'hct', 'rdw', 'mcv', 'mch', 'mchc', 'neutrophils',
+                'lymphocytes', 'monocytes', 'eosinophils', 'basophils', 'bun',
+                'temperature', 'ph', 'sodium', 'glucose', 'pao2', 'fio2', 'ldh', 'crp',
+                'direct_bilirubin', 'total_bilirubin', 'total_protein', 'albumin',
+                'ferritin', 'pt', 'ptt', 'fibrinogen', 'ast', 'alt', 'creatinine',
+                'troponin', 'alkaline_phosphatase', 'bands', 'bicarbonate', 'calcium',
+                'chloride', 'potassium', 'heart_rate', 'sao2', 'gcs', 'respiratory_rate',
+                'bp_systolic', 'bp_diastolic', 'bp_mean_arterial', 'orientation',
+                'censor_or_deceased_days', 'censor_or_vasopressor_days', 'censor_or_ventilator_days',
+                'd-dimer']
+BINARY_COLS = ['smoking', 'pleural_effusion',
+               'deceased_indicator', 'vasopressor_indicator', 'ventilator_indicator']
+CATEGORICAL_COLS = ['gender', 'ethnicity']
+DROP_COLS = ['hosp_id', 'cancer', 'liver_disease', 'chf', 'renal_failure']
+
+# columns not listed here are passed through as parsed
+COLUMN_SCHEMA = dict([(col, NUMERIC) for col in NUMERIC_COLS] +
+                     [(col, BINARY) for col in BINARY_COLS] +
+                     [(col, CATEGORICAL) for col in CATEGORICAL_COLS] +
+                     [(col, DROP) for col in DROP_COLS])
+INT_COLS = ['deceased_indicator']  # written as TRUE/FALSE by the R code
+GENDER_MAP = {'gender:m': 'Male', 'gender:f': 'Female'}
+
+IN_FNAMES = ['../../data/mimic/anypna/cleaner_mimic_anypna_timeline_flfv_{}_days_post_inicu.csv',
+             '../../data/mimic/anypna/cleaner_mimic_viralpna_timeline_flfv_{}_days_post_inicu.csv']
+OUT_DIR = '../../data/mimic/mimic_cleaned/'
+DAYS = range(3)
+
+
+BOOLEANS = {'TRUE': 1, 'FALSE': 0, 'True': 1, 'False': 0}
+
+
+def to_numeric(value):
+  """A numeric field, or nan if it is not a number (as pd.to_numeric with errors='coerce')."""
+  try:
+    return float(value)
+  except ValueError:
+    return np.nan
+
+
+def to_binary(value):
+  """A binary field as 0/1 (R writes logicals as TRUE/FALSE), or nan if it is not a number."""
+  if value in BOOLEANS:
+    return BOOLEANS[value]
+  number = to_numeric(value)
+  return int(number) if number in (0, 1) else number
+
+
+CONVERTERS = {NUMERIC: to_numeric, BINARY: to_binary}
+
+
+def read_flfv(fname, schema=COLUMN_SCHEMA):
+  """Read an flfv csv with the types of schema, skipping dropped columns."""
+  converters = dict((col, CONVERTERS[kind]) for (col, kind) in schema.items() if kind in CONVERTERS)
+  dtype = dict((col, str) for (col, kind) in schema.items() if kind == CATEGORICAL)
+  return pd.read_csv(fname, delimiter='|', usecols=lambda col: schema.get(col) != DROP, converters=converters,
+                     dtype=dtype)
+
+
+def clean_file(in_fname, out_fname):
+  df = read_flfv(in_fname)
+  df[INT_COLS] = df[INT_COLS].astype(int)
+  df['gender'] = df['gender'].replace(GENDER_MAP)
+  df.index.name = 'X'
+  df.to_csv(out_fname, index=True, sep='|')
+  if pyarrow is not None:
+    df.reset_index().to_parquet(os.path.splitext(out_fname)[0] + '.parquet', index=False)
+  return out_fname
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--workers', action="store", type=int, default=None,
+                      help='number of processes (default: one per file, capped at the cpu count)')
+  args = parser.parse_args()
+
+  jobs = [(in_fname.format(i), OUT_DIR + in_fname.split('/')[-1].format(i))
+          for in_fname in IN_FNAMES for i in DAYS]
+  n_workers = args.workers or min(len(jobs), os.cpu_count() or 1)
+  if n_workers > 1:
+    with multiprocessing.Pool(n_workers) as pool:
+      out_fnames = pool.starmap(clean_file, jobs)
+  else:
+    out_fnames = [clean_file(*job) for job in jobs]
+  for out_fname in out_fnames:
+    print('Wrote {}'.format(out_fname))
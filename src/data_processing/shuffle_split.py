@@ -2,16 +2,40 @@
 
 eICU is split into train/test. 
 MIMIC is the same except for shuffling and filtering out age >= 18.
+
+Each split is written as csv and, if pyarrow is installed, as parquet next to it, typed by preprocess.save_split
+with preprocess.SPLIT_DTYPES (preprocess.read_split prefers the parquet copy).
 """
 
+import os
+import sys
+
 import pandas as pd
 from sklearn.utils import shuffle
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocess import save_split  # noqa: E402
+
+try:
+  import pyarrow
+except ImportError:  # only write csv
+  pyarrow = None
+
 
 SPLIT_PROP = 0.7
 
-eicu_df = pd.read_csv('../../data/eicu/eicu_cleaned/eicu_anypna_2_days_post_inicu.csv')
-mimic_df = pd.read_csv('../../data/mimic/mimic_cleaned/cleaner_mimic_anypna_timeline_flfv_2_days_post_inicu.csv', sep='|')
+
+def read_cleaned(fpath, sep=','):
+  """Read a cleaned csv, or the parquet copy written next to it by the cleanup scripts if it is up to date."""
+  pq_fpath = os.path.splitext(fpath)[0] + '.parquet'
+  if pyarrow is not None and os.path.exists(pq_fpath) and \
+      (not os.path.exists(fpath) or os.path.getmtime(pq_fpath) >= os.path.getmtime(fpath)):
+    return pd.read_parquet(pq_fpath)
+  return pd.read_csv(fpath, sep=sep)
+
+
+eicu_df = read_cleaned('../../data/eicu/eicu_cleaned/eicu_anypna_2_days_post_inicu.csv')
+mimic_df = read_cleaned('../../data/mimic/mimic_cleaned/cleaner_mimic_anypna_timeline_flfv_2_days_post_inicu.csv', sep='|')
 mimic_df = mimic_df[mimic_df['age'] >= 18]
 
 eicu_df = shuffle(eicu_df)
@@ -21,6 +45,6 @@ split_idx = int(len(eicu_df) * SPLIT_PROP)
 train_eicu_df = eicu_df[:split_idx]
 test_eicu_df = eicu_df[split_idx:]
 
-train_eicu_df.to_csv('../../data/final_splits/eicu_any2_train.csv', index=False)
-test_eicu_df.to_csv('../../data/final_splits/eicu_any2_test.csv', index=False)
-mimic_df.to_csv('../../data/final_splits/mimic_any2_test.csv', index=False, sep=',')
+save_split(train_eicu_df, '../../data/final_splits/eicu_any2_train.csv', csv=True)
+save_split(test_eicu_df, '../../data/final_splits/eicu_any2_test.csv', csv=True)
+save_split(mimic_df, '../../data/final_splits/mimic_any2_test.csv', csv=True)
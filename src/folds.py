@@ -0,0 +1,58 @@
+"""Cross-validation fold assignments shared by every engine, computed once per dataset, seed and number of folds.
+
+get_foldid returns the fold (1 to nfolds) of each row of a train split, balanced as in cv.glmnet. It is saved to
+folds/{dataset hash}_seed{seed}_nfolds{nfolds}.npy, where the hash is of the rows' values (X, time and event), so
+reruns, resumed runs and every engine use the same folds: pipeline.py passes them to cv.glmnet as foldid (instead
+of letting glmnet draw its own after set.seed) and to coxnet.cv_coxnet, and grid_runner.py to its fold units.
+Results of --engine glmnet and --engine coxnet are therefore computed on the same folds and directly comparable.
+
+  foldid = get_foldid(d['X_train'], d['y_train'].iloc[:, 0], d['y_train'].iloc[:, 1], seed=499, nfolds=10)
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from coxnet import fold_ids
+
+
+fold_path = "folds"
+
+_foldids = {}  # fold assignments already loaded in this process, by file name
+
+
+def dataset_hash(X, time, event):
+  """sha1 of the rows' values, as float64."""
+  h = hashlib.sha1()
+  for a in [X, time, event]:
+    a = np.ascontiguousarray(np.asarray(a, dtype=np.float64))
+    h.update(repr(a.shape).encode())
+    h.update(a.tobytes())
+  return h.hexdigest()
+
+
+def fold_fname(X, time, event, seed, nfolds, path=None):
+  return os.path.join(fold_path if path is None else path, '{}_seed{}_nfolds{}.npy'.format(
+    dataset_hash(X, time, event)[:16], seed, nfolds))
+
+
+def get_foldid(X, time, event, seed, nfolds=10, path=None):
+  """Fold of each row (1 to nfolds), loaded from path (default: fold_path) or drawn with seed and saved there."""
+  fname = fold_fname(X, time, event, seed, nfolds, path)
+  if fname not in _foldids:
+    if os.path.exists(fname):
+      foldid = np.load(fname)
+    else:
+      foldid = fold_ids(len(time), nfolds, seed)
+      dirname = os.path.dirname(fname)
+      if not os.path.exists(dirname):
+        os.makedirs(dirname)
+      # write under a temporary name and rename, so that concurrent runs never read a partial file
+      fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.npy')
+      with os.fdopen(fd, 'wb') as fout:
+        np.save(fout, foldid)
+      os.replace(tmp, fname)
+    _foldids[fname] = foldid
+  return _foldids[fname].copy()
@@ -0,0 +1,189 @@
+"""Run the penalizer grid search of pipeline.py for several seeds and outcomes at once, on a process pool.
+
+Each (seed, outcome) train split is preprocessed once (get_data, cached as usual) and copied to shared memory,
+which the workers attach to when they start, so no data is pickled per task. With --engine coxnet, the work units
+are the cross-validation folds of each (seed, outcome, l1_ratio), plus the fit on all rows that gives nzero; each
+unit fits the whole penalizer path, warm-started, rather than a single penalizer. With --engine glmnet, each
+(seed, outcome, l1_ratio) is one cv.glmnet call, in the worker's own R, which runs its folds in turn: only
+seeds, outcomes and l1_ratios are spread over the workers, so use --engine coxnet for fold-level parallelism.
+The train splits are loaded (get_data) one after another in the parent process before the pool starts. The results are merged into the same
+grid_out/{tag}_grid_search.pkl files as pipeline.py writes, with the same folds (folds.get_foldid, so the same
+scores). With
+--resume, saved results that match their checksum are kept, and only their missing penalizers are run.
+
+  python grid_runner.py --seeds 499 88 95 128 424 77 22 49 356 274 --outcomes deceased vasopressor ventilator \
+      --engine coxnet --workers 8
+"""
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import coxnet
+import pipeline
+
+
+class SharedArrays(object):
+  """numpy arrays copied to shared memory blocks; spec describes them to attach_arrays in other processes."""
+
+  def __init__(self):
+    self.blocks = []
+    self.spec = {}
+
+  def add(self, key, array):
+    array = np.ascontiguousarray(array)
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    self.blocks.append(shm)
+    self.spec[key] = (shm.name, array.shape, array.dtype.str)
+
+  def close(self):
+    for shm in self.blocks:
+      shm.close()
+      shm.unlink()
+    self.blocks = []
+
+
+_blocks = []
+_arrays = {}
+_config = {}
+
+
+def attach_arrays(spec, config):
+  """Pool initializer: attach to the shared arrays of spec, once per worker."""
+  for key, (name, shape, dtype) in spec.items():
+    shm = SharedMemory(name=name)
+    _blocks.append(shm)
+    _arrays[key] = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+  _config.update(config)
+
+
+def run_unit(unit):
+  """One work unit (seed, outcome, l1_ratio, fold): fold 0 is the fit on all rows, None a whole cv.glmnet."""
+  seed, outcome, l1_ratio, fold = unit
+  X, time_, event, foldid = [_arrays[(seed, outcome, k)] for k in ['X', 'time', 'event', 'foldid']]
+  alp, lbds = pipeline.get_lambdas(l1_ratio, _config['pens'][(seed, outcome, l1_ratio)])
+  if fold is None:
+    import pandas as pd
+    columns, y_columns = _config['columns'][(seed, outcome)]
+    X_tr = pd.DataFrame(X, columns=columns)
+    y_tr = pd.DataFrame({y_columns[0]: time_, y_columns[1]: event}, columns=y_columns)
+    return unit, pipeline.run_cv_glmnet(X_tr, y_tr, alp, lbds, seed, foldid)
+  elif fold == 0:
+    return unit, coxnet.coxnet_path(X, time_, event, lbds, alpha=alp)
+  return unit, coxnet.cv_fold(X, time_, event, lbds, foldid == fold, alpha=alp)
+
+
+def get_units(runs, engine, pens):
+  """Work units of the (seed, outcome) runs, for the l1_ratios with penalizers to run in pens."""
+  folds = [None] if engine == 'glmnet' else list(range(pipeline.nfolds + 1))
+  return [(seed, outcome, l1_ratio, fold) for (seed, outcome) in runs for l1_ratio in pipeline.l1_ratios
+          if pens[(seed, outcome, l1_ratio)] for fold in folds]
+
+
+def merge_results(results, seed, outcome, engine, pens):
+  """pipeline's grid search results for (seed, outcome), from the results of its units."""
+  all_scores = {}
+  zero_betas = {}
+  errors = {}
+  for l1_ratio in pipeline.l1_ratios:
+    if not pens[(seed, outcome, l1_ratio)]:
+      continue
+    _, lbds = pipeline.get_lambdas(l1_ratio, pens[(seed, outcome, l1_ratio)])
+    if engine == 'glmnet':
+      fit = results[(seed, outcome, l1_ratio, None)]
+    else:
+      folds = [results[(seed, outcome, l1_ratio, fold)] for fold in range(1, pipeline.nfolds + 1)]
+      fit = coxnet.cv_summary(lbds, [c for (c, _) in folds], [w for (_, w) in folds],
+                              results[(seed, outcome, l1_ratio, 0)])
+    pipeline.add_scores(fit, lbds, l1_ratio, all_scores, zero_betas, pens[(seed, outcome, l1_ratio)])
+  return {
+    'all_scores': all_scores,
+    'zero_betas': zero_betas,
+    'errors': errors,
+  }
+
+
+def run_grid(seeds, outcomes, prefix='any', day=2, impute=-1, engine='coxnet', workers=None, resume=False):
+  """Grid search results for every (seed, outcome), saved as by pipeline.py; returns the file names."""
+  from folds import get_foldid
+  from preprocess import get_data
+
+  # the penalizers to run for each (seed, outcome, l1_ratio): all of them, or with resume those not saved yet
+  saved = {}
+  pens = {}
+  runs = []
+  for seed in seeds:
+    for outcome in outcomes:
+      tag = pipeline.get_tag(prefix, day, outcome, seed, impute, engine)
+      saved[(seed, outcome)] = pipeline.load_checked(pipeline.grid_fname(tag)) if resume else None
+      cells = pipeline.missing_cells(saved[(seed, outcome)])
+      if not cells:
+        print('skipping {}: saved'.format(tag))
+        continue
+      runs.append((seed, outcome))
+      for l1_ratio in pipeline.l1_ratios:
+        pens[(seed, outcome, l1_ratio)] = pipeline.get_cell_penalizers(
+          cells if saved[(seed, outcome)] is not None else None, l1_ratio, engine)
+  if not runs:
+    return []
+
+  shared = SharedArrays()
+  columns = {}
+  for (seed, outcome) in runs:
+    d = get_data(seed=seed, prefix=prefix, day=day, impute=impute, outcome=outcome, save=True)
+    X_tr, y_tr = d['X_train'], d['y_train']
+    X, time_, event = [a.astype(np.float64) for a in [X_tr.values, y_tr.iloc[:, 0].values, y_tr.iloc[:, 1].values]]
+    shared.add((seed, outcome, 'X'), X)
+    shared.add((seed, outcome, 'time'), time_)
+    shared.add((seed, outcome, 'event'), event)
+    shared.add((seed, outcome, 'foldid'), get_foldid(X, time_, event, seed, pipeline.nfolds))
+    columns[(seed, outcome)] = (list(X_tr.columns), list(y_tr.columns))
+
+  units = get_units(runs, engine, pens)
+  print('{} units on {} workers'.format(len(units), workers or os.cpu_count()))
+  results = {}
+  start = time.time()
+  try:
+    with Pool(workers, initializer=attach_arrays, initargs=(shared.spec, {'columns': columns, 'pens': pens})) as pool:
+      for (unit, result) in pool.imap_unordered(run_unit, units):
+        results[unit] = result
+        print('{}/{} done ({:.1f}s): {}'.format(len(results), len(units), time.time() - start, unit))
+  finally:
+    shared.close()
+
+  fnames = []
+  for (seed, outcome) in runs:
+    grid_search_results = merge_results(results, seed, outcome, engine, pens)
+    if saved[(seed, outcome)] is not None:
+      grid_search_results = pipeline.merge_grid_search_results(
+        saved[(seed, outcome)], grid_search_results, pipeline.missing_cells(saved[(seed, outcome)]))
+    tag = pipeline.get_tag(prefix, day, outcome, seed, impute, engine)
+    fname = pipeline.grid_fname(tag)
+    pipeline.save_checked(fname, grid_search_results)
+    pipeline.store_results(tag, grid_search_results=grid_search_results)
+    fnames.append(fname)
+  return fnames
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='parallel grid search over seeds and outcomes')
+  parser.add_argument('--seeds', type=int, nargs='+', default=[499], action="store")
+  parser.add_argument('--outcomes', nargs='+', default=['deceased'], action="store")
+  parser.add_argument('--prefix', default="any", action="store")
+  parser.add_argument('--day', type=int, default=2, action="store")
+  parser.add_argument('--impute', default=-1, action="store")
+  parser.add_argument('--engine', default="coxnet", choices=pipeline.ENGINES, action="store",
+                      help='coxnet: one work unit per cross-validation fold; glmnet: one per (seed, outcome, '
+                           'l1_ratio), with the folds of each cv.glmnet call run in sequence')
+  parser.add_argument('--workers', type=int, default=None, action="store", help='default: all cores')
+  parser.add_argument('--resume', action="store_true", help='run only the penalizers without saved results')
+  args = parser.parse_args()
+
+  for fname in run_grid(args.seeds, args.outcomes, args.prefix, args.day, args.impute, args.engine, args.workers,
+                        args.resume):
+    print('saved {}'.format(fname))
@@ -0,0 +1,249 @@
+"""Imputer backends for preprocess: MissForest and cheaper alternatives, built by make_imputer.
+
+MissForestImputer is MissForest with an explicit worker count, early stopping, per-iteration timing and warm
+starts.
+
+missingpy's MissForest only records column means/modes in fit; the iterative random forest imputation runs in
+transform, on whatever data is being transformed. MissForestImputer keeps that behaviour (and, with the default
+settings, its results) and adds:
+
+* n_jobs: number of cores used for each forest fit (as in missingpy, -1 uses all of them)
+* tol: stop as soon as the relative change of the imputed values drops below tol
+* iteration timing: gammas_ and iter_times_ of the last transform, printed as it goes
+* keep_forests/init: keep the forests of the returned iteration, and start a later fit from them (e.g. on a
+  slightly larger cohort) instead of from the column means. Both only apply to fit_transform on the training
+  data: transforming other data (e.g. test splits) neither uses init nor replaces forests_
+
+The alternatives (see IMPUTERS) fit once and impute new data without refitting: sklearn's IterativeImputer with
+linear or ridge regressions, KNNTreeImputer and the column median plus missing-value indicators. Use
+benchmark_imputers.py to compare them against MissForest.
+"""
+
+import time
+
+import numpy as np
+from missingpy import MissForest
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.experimental import enable_iterative_imputer  # noqa: F401, registers IterativeImputer
+from sklearn.impute import IterativeImputer, SimpleImputer
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.neighbors import KDTree
+
+
+IMPUTERS = ['missforest', 'iterative_linear', 'iterative_ridge', 'knn', 'median']
+
+
+def make_imputer(method='missforest', seed=None, **params):
+  """Unfitted imputer of one of IMPUTERS; params override its defaults."""
+  if method == 'missforest':
+    return MissForestImputer(random_state=seed, **params)
+  elif method == 'iterative_linear':
+    return IterativeImputer(**dict({'estimator': LinearRegression(), 'max_iter': 10, 'random_state': seed}, **params))
+  elif method == 'iterative_ridge':
+    return IterativeImputer(**dict({'estimator': Ridge(alpha=1.0), 'max_iter': 10, 'random_state': seed}, **params))
+  elif method == 'knn':
+    return KNNTreeImputer(**params)
+  elif method == 'median':
+    return SimpleImputer(**dict({'strategy': 'median', 'add_indicator': True}, **params))
+  raise ValueError('unknown imputer {}, expected one of {}'.format(method, IMPUTERS))
+
+
+def imputed_columns(imputer, columns):
+  """Column names of a fitted imputer's output: the input columns plus any missing-value indicators."""
+  indicator = getattr(imputer, 'indicator_', None)
+  if indicator is None:
+    return list(columns)
+  return list(columns) + ['{}_missing'.format(columns[i]) for i in indicator.features_]
+
+
+def fill_values(imputer):
+  """Per-column value a fitted imputer fills in first (MissForest, iterative) or falls back to (KNN, median)."""
+  if isinstance(imputer, MissForest):
+    return np.asarray(imputer.statistics_.get('col_means'), dtype=np.float64)
+  elif isinstance(imputer, IterativeImputer):
+    return imputer.initial_imputer_.statistics_
+  elif isinstance(imputer, SimpleImputer):
+    return imputer.statistics_
+  elif isinstance(imputer, KNNTreeImputer):
+    return imputer.mean_
+  raise ValueError('no fill values for {}'.format(type(imputer).__name__))
+
+
+class KNNTreeImputer(BaseEstimator, TransformerMixin):
+  """k-nearest-neighbour imputation, with the neighbours found through a KD-tree over the training rows.
+
+  The tree is built on standardized rows with missing values at the column mean (sklearn's KNNImputer instead
+  computes nan-euclidean distances to every training row). Each missing value becomes the mean of the observed
+  values of its nearest training rows in that column, or the column mean if none of them has one.
+  """
+
+  def __init__(self, n_neighbors=5, leaf_size=40):
+    self.n_neighbors = n_neighbors
+    self.leaf_size = leaf_size
+
+  def fit(self, X, y=None):
+    X = np.array(X, dtype=np.float64)
+    self.mean_ = np.nanmean(X, axis=0)
+    self.scale_ = np.nanstd(X, axis=0)
+    self.scale_[~(self.scale_ > 0)] = 1.0
+    self.X_ = X
+    self.tree_ = KDTree(self._standardize(X), leaf_size=self.leaf_size)
+    return self
+
+  def _standardize(self, X):
+    Z = (X - self.mean_) / self.scale_
+    Z[np.isnan(Z)] = 0.0
+    return Z
+
+  def transform(self, X):
+    X = np.array(X, dtype=np.float64)
+    mask = np.isnan(X)
+    rows = np.where(mask.any(axis=1))[0]
+    if len(rows):
+      _, idx = self.tree_.query(self._standardize(X[rows]), k=min(self.n_neighbors, len(self.X_)))
+      neighbors = self.X_[idx]  # rows x neighbors x columns
+      observed = ~np.isnan(neighbors)
+      n_observed = observed.sum(axis=1)
+      means = np.where(observed, neighbors, 0.0).sum(axis=1) / np.maximum(n_observed, 1)
+      fill = np.where(n_observed > 0, means, self.mean_)
+      X[rows] = np.where(mask[rows], fill, X[rows])
+    return X
+
+
+class MissForestImputer(MissForest):
+
+  def __init__(self, max_iter=10, decreasing=False, missing_values=np.nan,
+               copy=True, n_estimators=100, criterion=('mse', 'gini'),
+               max_depth=None, min_samples_split=2, min_samples_leaf=1,
+               min_weight_fraction_leaf=0.0, max_features='auto',
+               max_leaf_nodes=None, min_impurity_decrease=0.0,
+               bootstrap=True, oob_score=False, n_jobs=-1, random_state=None,
+               verbose=0, warm_start=False, class_weight=None, tol=None, keep_forests=False):
+    super(MissForestImputer, self).__init__(
+      max_iter=max_iter, decreasing=decreasing, missing_values=missing_values, copy=copy,
+      n_estimators=n_estimators, criterion=criterion, max_depth=max_depth,
+      min_samples_split=min_samples_split, min_samples_leaf=min_samples_leaf,
+      min_weight_fraction_leaf=min_weight_fraction_leaf, max_features=max_features,
+      max_leaf_nodes=max_leaf_nodes, min_impurity_decrease=min_impurity_decrease,
+      bootstrap=bootstrap, oob_score=oob_score, n_jobs=n_jobs, random_state=random_state,
+      verbose=verbose, warm_start=warm_start, class_weight=class_weight)
+    self.tol = tol
+    self.keep_forests = keep_forests
+
+  def fit(self, X, y=None, cat_vars=None, init=None):
+    """Fit on X; init is a fitted MissForestImputer with keep_forests whose forests give the initial guess."""
+    super(MissForestImputer, self).fit(X, cat_vars=cat_vars)
+    self.init_forests_ = None
+    if init is not None:
+      if getattr(init, 'forests_', None) is None:
+        raise ValueError('init has no forests, fit it with keep_forests=True')
+      if init.n_cols_ != np.shape(X)[1]:
+        raise ValueError('init was fitted on {} columns, X has {}'.format(init.n_cols_, np.shape(X)[1]))
+      self.init_forests_ = init.forests_
+    self.n_cols_ = np.shape(X)[1]
+    return self
+
+  def fit_transform(self, X, y=None, **fit_params):
+    self.fit(X, **fit_params)
+    self._fitting = True  # see _miss_forest
+    try:
+      return self.transform(X)
+    finally:
+      self._fitting = False
+
+  def _forests(self):
+    """Unfitted regression and classification forests, configured like missingpy's."""
+    params = dict(n_estimators=self.n_estimators, max_depth=self.max_depth,
+                  min_samples_split=self.min_samples_split, min_samples_leaf=self.min_samples_leaf,
+                  min_weight_fraction_leaf=self.min_weight_fraction_leaf, max_features=self.max_features,
+                  max_leaf_nodes=self.max_leaf_nodes, min_impurity_decrease=self.min_impurity_decrease,
+                  bootstrap=self.bootstrap, oob_score=self.oob_score, n_jobs=self.n_jobs,
+                  random_state=self.random_state, verbose=self.verbose, warm_start=self.warm_start)
+    criterion = (self.criterion, self.criterion) if isinstance(self.criterion, str) else self.criterion
+    return (RandomForestRegressor(criterion=criterion[0], **params),
+            RandomForestClassifier(criterion=criterion[1], class_weight=self.class_weight, **params))
+
+  def _miss_forest(self, Ximp, mask):
+    """The missForest algorithm, as in missingpy, plus tol, timing, keep_forests and init (the last two only on
+    the data of fit_transform)."""
+    fitting = getattr(self, '_fitting', False)
+    num_vars = [] if self.num_vars_ is None else self.num_vars_
+    cat_vars = [] if self.cat_vars_ is None else self.cat_vars_
+    is_cat = np.zeros(Ximp.shape[1], dtype=bool)
+    is_cat[cat_vars] = True
+
+    # initial guess: column means and modes
+    fill = np.full(Ximp.shape[1], fill_value=np.nan)
+    if len(num_vars):
+      fill[num_vars] = self.statistics_.get('col_means')
+    if len(cat_vars):
+      fill[cat_vars] = self.statistics_.get('col_modes')
+    missing_rows, missing_cols = np.where(mask)
+    Ximp[missing_rows, missing_cols] = np.take(fill, missing_cols)
+    n_catmissing = np.sum(mask[:, cat_vars])
+
+    rf_regressor, rf_classifier = self._forests()
+
+    # sorted indices of cols in X based on missing count
+    misscount_idx = np.argsort(mask.sum(axis=0))
+    if self.decreasing is True:
+      misscount_idx = misscount_idx[::-1]
+    col_index = np.arange(Ximp.shape[1])
+    col_rows = {}
+    for s in misscount_idx:
+      mis_rows = np.where(mask[:, s])[0]
+      if len(mis_rows):
+        col_rows[s] = (np.where(~mask[:, s])[0], mis_rows, np.delete(col_index, s))
+
+    # warm start: one pass of predictions from the forests of a previous fit
+    if fitting and self.init_forests_ is not None:
+      for s, (obs_rows, mis_rows, s_prime) in col_rows.items():
+        if s in self.init_forests_:
+          Ximp[mis_rows, s] = self.init_forests_[s].predict(Ximp[np.ix_(mis_rows, s_prime)])
+
+    self.iter_count_ = 0
+    self.gammas_ = []
+    self.iter_times_ = []
+    gamma_new = 0
+    gamma_old = np.inf
+    gamma_newcat = 0
+    gamma_oldcat = np.inf
+    forests, forests_old = {}, None
+    converged = False
+
+    while (gamma_new < gamma_old or gamma_newcat < gamma_oldcat) and self.iter_count_ < self.max_iter:
+      start = time.time()
+      Ximp_old = np.copy(Ximp)
+      if self.iter_count_ != 0:
+        gamma_old = gamma_new
+        gamma_oldcat = gamma_newcat
+      forests_old, forests = forests, {}
+
+      for s, (obs_rows, mis_rows, s_prime) in col_rows.items():
+        rf = rf_classifier if is_cat[s] else rf_regressor
+        if fitting and self.keep_forests:
+          rf = clone(rf)
+          forests[s] = rf
+        rf.fit(X=Ximp[np.ix_(obs_rows, s_prime)], y=Ximp[obs_rows, s])
+        Ximp[mis_rows, s] = rf.predict(Ximp[np.ix_(mis_rows, s_prime)])
+
+      # stopping criterion
+      if len(cat_vars):
+        gamma_newcat = np.sum(Ximp[:, cat_vars] != Ximp_old[:, cat_vars]) / n_catmissing
+      if len(num_vars):
+        gamma_new = np.sum((Ximp[:, num_vars] - Ximp_old[:, num_vars]) ** 2) / np.sum(Ximp[:, num_vars] ** 2)
+
+      self.gammas_.append(gamma_new)
+      self.iter_times_.append(time.time() - start)
+      print('Iteration: {} (gamma {:.3g}, {:.1f}s)'.format(self.iter_count_, gamma_new, self.iter_times_[-1]))
+      self.iter_count_ += 1
+
+      if self.tol is not None and gamma_new < self.tol and (not len(cat_vars) or gamma_newcat < self.tol):
+        converged = True
+        break
+
+    if fitting and self.keep_forests:
+      self.forests_ = forests if converged else forests_old
+    # without early stopping, the loop ran one iteration past the best one
+    return Ximp if converged else Ximp_old
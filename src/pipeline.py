@@ -1,80 +1,68 @@
+"""Grid search over the glmnet Cox penalty (cv.glmnet in R, through rpy2) and fit of the final models.
+
+  python pipeline.py --seed=499 --prefix=any --outcome=deceased --day=2 --impute=-1
+
+With --engine coxnet, the cross-validation runs in numpy (coxnet.py) instead of R.
+
+Importing this module is cheap: rpy2 and the R packages, lifelines and matplotlib are loaded on first use (see
+r_package), so that helpers such as get_glmnet_params or get_concordances can be used from other code.
+"""
+
+import argparse
+import functools
+import hashlib
 import os
-import pprint
 import pickle
+import random
 
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 
-from lifelines.utils import concordance_index, k_fold_cross_validation
-from lifelines import CoxPHFitter, WeibullAFTFitter
-from lifelines import KaplanMeierFitter
 
-from sklearn.model_selection import GridSearchCV, KFold
-from sklearn.utils import resample
-import random
-from preprocess import get_data
-import argparse
+survival_estimator_name = 'glmnet_cox'  # for this file
 
-import rpy2.robjects as ro
-from rpy2.robjects.packages import importr
-from rpy2.robjects import pandas2ri
-from rpy2.robjects import Formula 
-from rpy2.robjects.conversion import localconverter
+use_saved_values = False
+override_outputs = True
+cv_glmnet = True
 
-r_glmnet = importr('glmnet')
-r_surv = importr('survival')
-base = importr('base')
-utils = importr('utils')
-r_stats = importr('stats')
-r_graphics = importr('graphics')
-r_matrix = importr('Matrix')
+grid_path = "grid_out"
+plot_path = "plot"
+model_path = "models"
+store_path = "results.sqlite"  # see store_results; None to only write the pickles
 
+l1_ratios = [1.0]
+penalizers = [1.0, 0.75, 0.5, 0.25, 0.20, 0.15,0.1, 0.055, 0.05, 0.045, 0.04, 0.035, 0.03, 0.025, 0.02, 0.01, 0.001]
+best_ps = [0.025, 0.02]
+nfolds = 10
 
-survival_estimator_name = 'glmnet_cox'  # for this file
-parser = argparse.ArgumentParser(description='risk score for pn')
-parser.add_argument('--outcome', default="deceased", action="store")
-parser.add_argument('--cvglmnet', action="store_true")
-parser.add_argument('--prefix', default="any", action="store")
-parser.add_argument('--day', type=int, default=2, action="store")
-parser.add_argument('--impute', type=int, default=-1, action="store")
-parser.add_argument('--seed', type=int, default=499, action="store")
-parser.add_argument('--alpha', type=float, default=1.0, action="store")
-parser.add_argument('--cross_val_n_folds', type=int, default=5, action="store")
-parser.add_argument('--output_dir', default="output", action="store")
-args = parser.parse_args()
-
-outcome = args.outcome
-prefix = args.prefix
-day = args.day
-impute = args.impute  # use MissForest
-seed = args.seed
-np.random.seed(seed)
-random.seed(seed)
-
-d = get_data(seed=seed, prefix=prefix, day=day, impute=impute, outcome=outcome, save=True)
-
-X_tr = d['X_train']
-y_tr = d['y_train']
-X_te_eicu = d['X_test_eicu']
-y_te_eicu = d['y_test_eicu']
-X_te_mimic = d['X_test_mimic']
-y_te_mimic = d['y_test_mimic']
+ENGINES = ['glmnet', 'coxnet']
 
-def combine_Xy(X, y):
-    dataset = X.copy()
-    for col in y.columns:
-        dataset.loc[:, col] = y[col].tolist()
-    return dataset
+_r_Xy = {}  # R objects of the data sets converted by get_r_Xy
 
-tr_dataset = combine_Xy(X_tr, y_tr)
-te_eicu_dataset = combine_Xy(X_te_eicu, y_te_eicu)
-te_mimic_dataset = combine_Xy(X_te_mimic, y_te_mimic)
 
-tr_dataset.describe()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='risk score for pn')
+    parser.add_argument('--outcome', default="deceased", action="store")
+    parser.add_argument('--cvglmnet', action="store_true")
+    parser.add_argument('--prefix', default="any", action="store")
+    parser.add_argument('--day', type=int, default=2, action="store")
+    parser.add_argument('--impute', default=-1, action="store")  # -1 (MissForest) or a name in imputation.IMPUTERS
+    parser.add_argument('--seed', type=int, default=499, action="store")
+    parser.add_argument('--alpha', type=float, default=1.0, action="store")
+    parser.add_argument('--cross_val_n_folds', type=int, default=5, action="store")
+    parser.add_argument('--output_dir', default="output", action="store")
+    parser.add_argument('--engine', default="glmnet", choices=ENGINES, action="store")  # see run_grid_search
+    parser.add_argument('--n_boot', type=int, default=0, action="store")  # bootstrap CIs of the final concordances
+    parser.add_argument('--resume', action="store_true")  # reuse saved results, run only what is missing
+    parser.add_argument('--path_penalizers', type=float, nargs='+', default=None, action="store")  # fit_coxnet_path
+    return parser.parse_args(argv)
+
+
+@functools.lru_cache(maxsize=None)
+def r_package(name):
+    """R package imported through rpy2; R is started by the first call."""
+    from rpy2.robjects.packages import importr
+    return importr(name)
 
-duration_col = y_tr.columns[0]
-event_col = y_tr.columns[1]
 
 def get_glmnet_params(l1_ratio, penalizer):
     l2_coeff = 0.5 * penalizer * (1 - l1_ratio)
@@ -93,208 +81,327 @@ def get_lifelines_params(alpha, lmbda):
     return l1_ratio, penalizer
 
 def get_r_df(y_tr):
+    import rpy2.robjects as ro
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
     with localconverter(ro.default_converter + pandas2ri.converter):
         r_y_tr = ro.conversion.py2rpy(y_tr)
     return r_y_tr
 
-use_saved_values = False
-override_outputs = True
-cv_glmnet = True
+def r_float_vector(a):
+    """R numeric vector with the values of a (a single copy of a float64 buffer into R's memory)."""
+    import rpy2.robjects as ro
+    from rpy2.rinterface import FloatSexpVector
+    a = np.ascontiguousarray(a, dtype=np.float64).ravel()
+    return ro.FloatVector(FloatSexpVector.from_memoryview(memoryview(a)))
+
+
+def get_r_Xy(X_tr, y_tr):
+    """The design matrix of X_tr (an R numeric matrix, with its column names) and the Surv of y_tr (time, event).
+
+    The columns are copied to R as float64 buffers, skipping pandas2ri's per-column conversion to a data.frame and
+    as.matrix's copy of it, and the converted objects are kept for the process, keyed by the data's hash: the runs
+    of every l1_ratio (and grid_runner's units on the same split) reuse them.
+    """
+    import rpy2.robjects as ro
+    from folds import dataset_hash
+    X = np.asarray(X_tr, dtype=np.float64)
+    time, event = [np.asarray(y_tr.iloc[:, k], dtype=np.float64) for k in [0, 1]]
+    key = (dataset_hash(X, time, event), tuple(X_tr.columns))
+    if key not in _r_Xy:
+        x_m = r_float_vector(X.ravel(order='F'))  # R matrices are column-major
+        x_m.do_slot_assign('dim', ro.IntVector(X.shape))
+        x_m.do_slot_assign('dimnames', ro.r['list'](ro.NULL, ro.StrVector([str(c) for c in X_tr.columns])))
+        surv = r_package('survival').Surv(r_float_vector(time), r_float_vector(event))
+        _r_Xy[key] = (x_m, surv)
+    return _r_Xy[key]
 
-grid_path = "grid_out"
-if not os.path.exists(grid_path):
-    os.makedirs(grid_path)
 
-goal = "l1_search" if not cv_glmnet else "cvglmnet"
-tag = '{prefix}_day{day}_{outcome}_seed{seed}_{goal}'.format(prefix=prefix, day=day, outcome=outcome, seed=seed, goal=goal)
-fname = '{path}/{tag}_grid_search.pkl'.format(path=grid_path,tag=tag)
+def combine_Xy(X, y):
+    dataset = X.copy()
+    for col in y.columns:
+        dataset.loc[:, col] = y[col].tolist()
+    return dataset
+
 
+def get_tag(prefix, day, outcome, seed, impute=-1, engine='glmnet'):
+    from preprocess import impute_method
+    goal = "l1_search" if not cv_glmnet else "cvglmnet"
+    tag = '{prefix}_day{day}_{outcome}_seed{seed}_{goal}'.format(prefix=prefix, day=day, outcome=outcome, seed=seed, goal=goal)
+    if impute_method(impute) != 'missforest':  # -1 and 'missforest' are the same imputer, and share a tag
+        tag += '_' + impute_method(impute)
+    if engine != 'glmnet':
+        tag += '_' + engine
+    return tag
 
-l1_ratios = [1.0]  
 
-penalizers = [1.0, 0.75, 0.5, 0.25, 0.20, 0.15,0.1, 0.055, 0.05, 0.045, 0.04, 0.035, 0.03, 0.025, 0.02, 0.01, 0.001]
+def run_cv_glmnet(X_tr, y_tr, alp, lbds, seed, foldid=None):
+    """cv.glmnet in R, on the folds foldid (see folds.get_foldid) if given; returns its lambda, cvm, cvsd and nzero
+    as numpy arrays."""
+    import rpy2.robjects as ro
+    r_glmnet = r_package('glmnet')
+    base = r_package('base')
 
-# Doing cross validatin for penalizer selection
-if os.path.exists(fname) and use_saved_values:    
-    with open(fname, 'rb') as fin:
-        grid_search_results = pickle.load(fin)
+    x_m, surv1 = get_r_Xy(X_tr, y_tr)
+
+    # train glmnet
+    r_lbds = ro.FloatVector(lbds)
+    base.set_seed(seed)
+    folds = {"nfolds": nfolds} if foldid is None else {"foldid": ro.IntVector(foldid)}
+    fit = r_glmnet.cv_glmnet(x=x_m,y=surv1, alpha=alp, **{"lambda":r_lbds},family="cox",  maxit = 1e6,type_measure = "C", **folds)
+    return dict((k, np.array(fit.rx2(k))) for k in ['lambda', 'cvm', 'cvsd', 'nzero'])
 
-    all_scores = grid_search_results['all_scores']
-    zero_betas = grid_search_results['zero_betas']
-    errors = grid_search_results['errors']
-    print("get saved")
 
-else:
+def run_cv_coxnet(X_tr, y_tr, alp, lbds, seed, foldid=None):
+    """The same cross-validation with coxnet, in numpy (no R needed)."""
+    from coxnet import cv_coxnet
+    return cv_coxnet(X_tr.values, y_tr.iloc[:, 0].values, y_tr.iloc[:, 1].values, lbds, alpha=alp, nfolds=nfolds,
+                     seed=seed, foldid=foldid)
+
+
+def run_grid_search(X_tr, y_tr, seed, engine='glmnet', cells=None):
+    """CV over penalizers for each of l1_ratios; returns all_scores, zero_betas and errors by (penalizer, l1_ratio).
+
+    engine is 'glmnet' (cv.glmnet in R, through rpy2) or 'coxnet' (coxnet.cv_coxnet). With cells, a list of
+    (penalizer, l1_ratio), only the penalizers of those cells are run (see get_cell_penalizers). Every engine uses
+    the folds of folds.get_foldid.
+    """
+    from folds import get_foldid
+    run_cv = run_cv_coxnet if engine == 'coxnet' else run_cv_glmnet
+    foldid = get_foldid(X_tr.values, y_tr.iloc[:, 0].values, y_tr.iloc[:, 1].values, seed, nfolds)
+
     all_scores = {}
     zero_betas = {}
     errors = {}
     for l1_ratio in l1_ratios:
-        # for penalizer in penalizers:
-        nfeatures= []
-
-        # data preparation
-        alp , lbd = get_glmnet_params(l1_ratio, penalizers[0])
-        lbds = []
-        for p in penalizers:
-            _, lbd = get_glmnet_params(l1_ratio, p)
-            lbds.append(lbd)
-
-        r_X_tr = get_r_df(X_tr)
-        r_y_tr = get_r_df(y_tr)
-
-        # train glmnet 
-        surv1 = r_surv.Surv(r_y_tr[0], r_y_tr[1])
-        x_m = base.as_matrix(r_X_tr)
-        r_lbds = ro.FloatVector(lbds)
-        nfolds = 10
-        base.set_seed(seed)
-        fit = r_glmnet.cv_glmnet(x=x_m,y=surv1, alpha=alp, **{"lambda":r_lbds},family="cox",  maxit = 1e6,type_measure = "C")
-        non_zeros = np.array(fit.rx2("nzero")).tolist()
-        print('non_zero:{}'.format(non_zeros))
-        r_lbds = np.array(fit.rx2("lambda")).tolist()
-        scores = np.array(fit.rx2("cvm")).tolist()
-        r_cvsd = np.array(fit.rx2("cvsd")).tolist()
-        no_match = np.array(lbds != r_lbds).sum()
-        print('double check num no match lbds:', no_match)
-
-        for i, n_nonzero in enumerate(non_zeros):
-            tup = (penalizers[i], l1_ratio)
-            if n_nonzero > 0:  # only include hyperparams w/ a nonzero beta
-                all_scores[tup] = {'scores': scores[i], 'std':r_cvsd[i], 'n_nonzero': n_nonzero}
-                print("mean c:", scores[i], "std", r_cvsd[i], "mean f:", n_nonzero)
-            else:
-                zero_betas[tup] = {'scores': scores[i], 'std':r_cvsd[i],'n_nonzero': n_nonzero}
-
+        pens = get_cell_penalizers(cells, l1_ratio, engine)
+        if not pens:
+            continue
+        alp, lbds = get_lambdas(l1_ratio, pens)
+        fit = run_cv(X_tr, y_tr, alp, lbds, seed, foldid)
+        add_scores(fit, lbds, l1_ratio, all_scores, zero_betas, pens)
+
+    return all_scores, zero_betas, errors
+
+
+def get_lambdas(l1_ratio, pens=None):
+    """glmnet alpha and lambdas of penalizers (or pens) at l1_ratio."""
+    pens = penalizers if pens is None else pens
+    # data preparation
+    alp , lbd = get_glmnet_params(l1_ratio, pens[0])
+    lbds = []
+    for p in pens:
+        _, lbd = get_glmnet_params(l1_ratio, p)
+        lbds.append(lbd)
+    return alp, lbds
+
+
+def get_cell_penalizers(cells, l1_ratio, engine='glmnet'):
+    """The penalizers to run at l1_ratio for cells (all of them if cells is None), in the order of penalizers."""
+    if cells is None:
+        return list(penalizers)
+    pens = [p for p in penalizers if (p, l1_ratio) in cells]
+    if len(pens) == 1 and engine == 'glmnet' and len(penalizers) > 1:
+        # cv.glmnet needs two lambdas or more: also run another penalizer, whose result is then discarded
+        extra = penalizers[1] if pens[0] == penalizers[0] else penalizers[0]
+        pens = [p for p in penalizers if p in (pens[0], extra)]
+    return pens
+
+
+def missing_cells(grid_search_results):
+    """The (penalizer, l1_ratio) cells of the grid with no result in grid_search_results (or all, if None)."""
+    done = set()
+    if grid_search_results is not None:
+        done = set(grid_search_results['all_scores']) | set(grid_search_results['zero_betas'])
+    return [(p, l) for l in l1_ratios for p in penalizers if (p, l) not in done]
+
+
+def merge_grid_search_results(saved, new, cells):
+    """saved grid search results, with the results of cells taken from new."""
+    merged = dict((k, dict(saved[k]) if saved is not None else {}) for k in ['all_scores', 'zero_betas', 'errors'])
+    for k in ['all_scores', 'zero_betas']:
+        for tup, s in new[k].items():
+            if tup in cells:
+                merged['all_scores'].pop(tup, None)
+                merged['zero_betas'].pop(tup, None)
+                merged[k][tup] = s
+    merged['errors'].update(new['errors'])
+    return merged
+
+
+def save_checked(fname, obj):
+    """Pickle obj to fname, then write the sha256 of the file to fname.sha256 (so a crash leaves no valid pair)."""
+    data = pickle.dumps(obj)
+    with open(fname + '.tmp', 'wb') as fout:
+        fout.write(data)
+    os.replace(fname + '.tmp', fname)
+    with open(fname + '.sha256', 'w') as fout:
+        fout.write(hashlib.sha256(data).hexdigest())
+
+
+def load_checked(fname):
+    """The object saved by save_checked to fname; None if either file is missing or they do not match."""
+    if not (os.path.exists(fname) and os.path.exists(fname + '.sha256')):
+        return None
+    with open(fname, 'rb') as fin:
+        data = fin.read()
+    with open(fname + '.sha256') as fin:
+        digest = fin.read().strip()
+    if hashlib.sha256(data).hexdigest() != digest:
+        print('checksum mismatch, ignoring {}'.format(fname))
+        return None
+    return pickle.loads(data)
+
+
+def add_scores(fit, lbds, l1_ratio, all_scores, zero_betas, pens=None):
+    """Add the CV results fit (lambda, cvm, cvsd, nzero) to all_scores, or zero_betas if no beta is nonzero."""
+    non_zeros = np.array(fit["nzero"]).tolist()
+    print('non_zero:{}'.format(non_zeros))
+    r_lbds = np.array(fit["lambda"]).tolist()
+    scores = np.array(fit["cvm"]).tolist()
+    r_cvsd = np.array(fit["cvsd"]).tolist()
+    no_match = np.array(lbds != r_lbds).sum()
+    print('double check num no match lbds:', no_match)
+
+    pens = penalizers if pens is None else pens
+    for i, n_nonzero in enumerate(non_zeros):
+        tup = (pens[i], l1_ratio)
+        if n_nonzero > 0:  # only include hyperparams w/ a nonzero beta
+            all_scores[tup] = {'scores': scores[i], 'std':r_cvsd[i], 'n_nonzero': n_nonzero}
+            print("mean c:", scores[i], "std", r_cvsd[i], "mean f:", n_nonzero)
+        else:
+            zero_betas[tup] = {'scores': scores[i], 'std':r_cvsd[i],'n_nonzero': n_nonzero}
+
+
+def grid_fname(tag):
+    if not os.path.exists(grid_path):
+        os.makedirs(grid_path)
+    return '{path}/{tag}_grid_search.pkl'.format(path=grid_path,tag=tag)
+
+
+def get_grid_search_results(X_tr, y_tr, seed, tag, engine='glmnet', resume=None):
+    """Grid search results saved under grid_path.
+
+    With resume (default: use_saved_values), saved results that match their checksum are reused, and only the
+    cells of the grid they do not have are run.
+    """
+    fname = grid_fname(tag)
+    resume = use_saved_values if resume is None else resume
+
+    # Doing cross validatin for penalizer selection
+    saved = load_checked(fname) if resume else None
+    cells = missing_cells(saved)
+    if not cells:
+        print("get saved")
+        return saved
+    if saved is not None:
+        print('running {} missing cells: {}'.format(len(cells), cells))
+
+    all_scores, zero_betas, errors = run_grid_search(X_tr, y_tr, seed, engine, cells if saved is not None else None)
     grid_search_results = {
     'all_scores': all_scores,
     'zero_betas': zero_betas,
     'errors': errors,
     }
+    if saved is not None:
+        grid_search_results = merge_grid_search_results(saved, grid_search_results, cells)
 
     if override_outputs:
-        with open(fname, 'wb') as fout:
-            pickle.dump(grid_search_results, fout)     
+        save_checked(fname, grid_search_results)
+        store_results(tag, grid_search_results=grid_search_results)
 
     print("the end")
-
-
-# # Grid search result
-
-
-if not cv_glmnet:
-    score_summary = []
-    for (tup, s) in all_scores.items():
-        mean = np.mean(s['scores'])
-        std = np.std(s['scores'])
-        summary = {
-            'hyperparams': {'penalizer': tup[0], 'l1_ratio': tup[1]},
-            'mean_concordance': mean, 'std_concordance': std, 
-            'beta_nonzero': s['n_nonzero'],
-        }
-        score_summary.append(summary)
-
-    top3 = list(reversed(sorted(score_summary, key=lambda x: x['mean_concordance'])))[:3]
-    best_params = top3[0]['hyperparams']
-
-    zero_beta_summary = []
-    for (tup, s) in zero_betas.items():
-        mean = np.mean(s['scores'])
-        std = np.std(s['scores'])
-        summary = {
-            'hyperparams': {'penalizer': tup[0], 'l1_ratio': tup[1]},
-            'mean_concordance': mean, 'std_concordance': std, 
-            'beta_nonzero': s['n_nonzero'],
-        }
-        zero_beta_summary.append(summary)
-    zero_top3 = list(reversed(sorted(zero_beta_summary, key=lambda x: x['mean_concordance'])))[:3]
-else:
+    return grid_search_results
+
+
+def store_results(tag, grid_search_results=None, cph_results=None, l1_ratio=1.0):
+    """Append grid search results or final model summaries of the run tag to the result store at store_path."""
+    if not store_path:
+        return
+    from results_store import ResultStore, parse_tag
+    store = ResultStore(store_path)
+    try:
+        if grid_search_results is not None:
+            store.add_grid(parse_tag(tag), grid_search_results)
+        if cph_results is not None:
+            store.add_models(parse_tag(tag), cph_results, l1_ratio)
+    finally:
+        store.close()
+
+
+def summarize_scores(scores):
+    """Score summaries sorted by decreasing mean concordance."""
     score_summary = []
-    for (tup, s) in all_scores.items():
-        #print(s)
-        mean = s['scores']
-        std = s['std']
+    for (tup, s) in scores.items():
+        if not cv_glmnet:
+            mean = np.mean(s['scores'])
+            std = np.std(s['scores'])
+        else:
+            mean = s['scores']
+            std = s['std']
         summary = {
             'hyperparams': {'penalizer': tup[0], 'l1_ratio': tup[1]},
-            'mean_concordance': mean, 'std_concordance': std, 
+            'mean_concordance': mean, 'std_concordance': std,
             'beta_nonzero': s['n_nonzero'],
         }
         score_summary.append(summary)
-
-    top3 = list(reversed(sorted(score_summary, key=lambda x: x['mean_concordance'])))[:3]
-    best_params = top3[0]['hyperparams']
+    return list(reversed(sorted(score_summary, key=lambda x: x['mean_concordance'])))
 
 
+def plot_grid_search(all_scores, zero_betas, tag):
+    import matplotlib.pyplot as plt
 
+    merged_scores = dict(all_scores)
+    for tup in zero_betas:
+        merged_scores[tup] = zero_betas[tup]
 
-    zero_beta_summary = []
-    for (tup, s) in zero_betas.items():
+    nfeat_to_summary = {}
+    for (tup, s) in merged_scores.items():
         mean = s['scores']
         std = s['std']
-        summary = {
-            'hyperparams': {'penalizer': tup[0], 'l1_ratio': tup[1]},
-            'mean_concordance': mean, 'std_concordance': std, 
-            'beta_nonzero': s['n_nonzero'],
-        }
-        zero_beta_summary.append(summary)
-    zero_top3 = list(reversed(sorted(zero_beta_summary, key=lambda x: x['mean_concordance'])))[:3]
-
-
-
-
-
-merged_scores = all_scores
-for tup in zero_betas:
-    merged_scores[tup] = zero_betas[tup]
-
-nfeat_to_summary = {}
-for (tup, s) in merged_scores.items():
-    mean = s['scores']
-    std = s['std']
-    n_nonzero = s['n_nonzero']
-    if nfeat_to_summary.get(n_nonzero, {'mean': -1})['mean'] < mean:
-        nfeat_to_summary[n_nonzero] = {'mean': mean, 
-                                       'std': std,
-                                       'penalizer': tup[0], 
-                                       'l1_ratio': tup[1]}
-
-x = np.array(sorted(list(nfeat_to_summary.keys())))
-y = np.array([nfeat_to_summary[nf]['mean'] for nf in x])
-y_sigma = np.array([nfeat_to_summary[nf]['std'] for nf in x])
-y_penalizer = np.array([nfeat_to_summary[nf]['penalizer'] for nf in x])
-y_l1_ratio = np.array([nfeat_to_summary[nf]['l1_ratio'] for nf in x])
-
-fig, ax = plt.subplots(3, 1, figsize=(12,8))
-fig.tight_layout(pad=4)
-ax[0].plot(x, y, 'bo-', lw=2, label='mean concordance')
-ax[0].fill_between(x, y+y_sigma, y-y_sigma, facecolor='blue', alpha=0.5)
-ax[0].set_title(r'Best Concordance vs. Number of Features Selected')
-ax[0].grid()
-
-ax[1].plot(x, y_penalizer, 'bo-', lw=2, label='penalizer')
-ax[1].set_title(r'Best Penalizer vs. Number of Features Selected')
-ax[1].grid()
-for i, txt in enumerate(y_penalizer):
-    ax[1].annotate(txt, (x[i], y_penalizer[i]))
-    
-ax[2].plot(x, y_l1_ratio, 'bo-', lw=2, label='l1 ratio')
-ax[2].set_title(r'Best L1 Ratio vs. Number of Features Selected')
-ax[2].grid()
-for i, txt in enumerate(y_l1_ratio):
-    ax[2].annotate(txt, (x[i], y_l1_ratio[i]))
-
-plot_path = "plot"
-if not os.path.exists(plot_path):
-    os.makedirs(plot_path)
-fig.suptitle('Results from grid gearch for ' + tag)
-plt.savefig("{}/concordance_plot_{}.png".format(plot_path,tag))
-
-print('penalizer:', penalizers)
-
+        n_nonzero = s['n_nonzero']
+        if nfeat_to_summary.get(n_nonzero, {'mean': -1})['mean'] < mean:
+            nfeat_to_summary[n_nonzero] = {'mean': mean,
+                                           'std': std,
+                                           'penalizer': tup[0],
+                                           'l1_ratio': tup[1]}
+
+    x = np.array(sorted(list(nfeat_to_summary.keys())))
+    y = np.array([nfeat_to_summary[nf]['mean'] for nf in x])
+    y_sigma = np.array([nfeat_to_summary[nf]['std'] for nf in x])
+    y_penalizer = np.array([nfeat_to_summary[nf]['penalizer'] for nf in x])
+    y_l1_ratio = np.array([nfeat_to_summary[nf]['l1_ratio'] for nf in x])
+
+    fig, ax = plt.subplots(3, 1, figsize=(12,8))
+    fig.tight_layout(pad=4)
+    ax[0].plot(x, y, 'bo-', lw=2, label='mean concordance')
+    ax[0].fill_between(x, y+y_sigma, y-y_sigma, facecolor='blue', alpha=0.5)
+    ax[0].set_title(r'Best Concordance vs. Number of Features Selected')
+    ax[0].grid()
+
+    ax[1].plot(x, y_penalizer, 'bo-', lw=2, label='penalizer')
+    ax[1].set_title(r'Best Penalizer vs. Number of Features Selected')
+    ax[1].grid()
+    for i, txt in enumerate(y_penalizer):
+        ax[1].annotate(txt, (x[i], y_penalizer[i]))
+
+    ax[2].plot(x, y_l1_ratio, 'bo-', lw=2, label='l1 ratio')
+    ax[2].set_title(r'Best L1 Ratio vs. Number of Features Selected')
+    ax[2].grid()
+    for i, txt in enumerate(y_l1_ratio):
+        ax[2].annotate(txt, (x[i], y_l1_ratio[i]))
+
+    if not os.path.exists(plot_path):
+        os.makedirs(plot_path)
+    fig.suptitle('Results from grid gearch for ' + tag)
+    plt.savefig("{}/concordance_plot_{}.png".format(plot_path,tag))
+    plt.close(fig)
 
 
-
-from preprocess import load_csv
 def get_concordances(cph, X_tr, y_tr, X_eicu, y_eicu, X_mimic, y_mimic):
+    from concordance import concordance_index
+    duration_col = y_tr.columns[0]
+    event_col = y_tr.columns[1]
     pred_tr = cph.predict_partial_hazard(X_tr)
     pred_eicu = cph.predict_partial_hazard(X_eicu)
     pred_mimic = cph.predict_partial_hazard(X_mimic)
@@ -303,56 +410,181 @@ def get_concordances(cph, X_tr, y_tr, X_eicu, y_eicu, X_mimic, y_mimic):
     c_mimic = concordance_index(y_mimic[duration_col], -pred_mimic, y_mimic[event_col])
     #print("best CI (train, te_eicu, te_mimic):", c_tr, c_eicu, c_mimic)
     return c_tr, c_eicu, c_mimic
+
+
+def get_concordance_cis(cph, X_tr, y_tr, X_eicu, y_eicu, X_mimic, y_mimic, n_boot=1000, seed=None):
+    """Concordances of get_concordances with 95% bootstrap intervals: {'train'|'eicu'|'mimic': (c, lower, upper)}."""
+    from concordance import concordance_cis
+    cohorts = {}
+    for name, X, y in [('train', X_tr, y_tr), ('eicu', X_eicu, y_eicu), ('mimic', X_mimic, y_mimic)]:
+        cohorts[name] = (y.iloc[:, 0], -cph.predict_partial_hazard(X), y.iloc[:, 1])
+    return concordance_cis(cohorts, n_boot=n_boot, seed=seed)
 def neq_zero(a, prec=1e-6):
     return (a>prec) | (a< -prec)
 
 
-def show_results(i, cph_results, best_cphs, figures):
+def show_results(i, cph_results, best_cphs, figures, tr_dataset):
     print(cph_results[i])
     print("\n\n*****test assumptions***")
     figures[i].figure
     best_cphs[i].check_assumptions(tr_dataset)
 
-model_path = "models"
-if not os.path.exists(model_path):
-    os.makedirs(model_path)
-
-best_ps = [0.025, 0.02]
 
-print('best penalties:', best_ps)
-cph_results = {}
-best_cphs = []
-figures = []
-l = 1.0
-for i, p in enumerate(best_ps):
-    best_params = {"l1_ratio":l, "penalizer":p}
-    best_cph = CoxPHFitter(**best_params)
-    best_cph.fit(tr_dataset, duration_col=
-                 duration_col, event_col=event_col, step_size=0.15)
-    ctr, ceicu, cmimic = get_concordances(best_cph,X_tr, y_tr, X_te_eicu, y_te_eicu, X_te_mimic, y_te_mimic)
-    nzeros = neq_zero(best_cph.params_)
-    coefs = nzeros.index[nzeros.values].to_list()
-    coefs_val = best_cph.params_[nzeros.values].tolist()
-
-    summary = {
-        "penalizer":p,
-        "C_train": ctr,
-        "C_eicu:":ceicu,
-        "C_mimic":cmimic,
-        "nfeatures":len(coefs),
-        "features":coefs,
-        "coefs": coefs_val,
-        "df": pd.DataFrame({"features":coefs, "coefs":coefs_val})
+def fit_path(tr_dataset, duration_col, event_col, penalizers, l1_ratio=1.0, warm_start=True, step_size=0.15):
+    """CoxPHFitter fits for penalizers, largest first, each started from the coefficients of the previous fit.
+
+    Returns the fitted models and the seconds of each fit, both by penalizer. With an L1 penalty, lifelines sharpens
+    its smooth |beta| with every iteration whatever the starting point, so warm starts save little there; for dense
+    sweeps of the penalty use fit_coxnet_path.
+    """
+    import time
+    from lifelines import CoxPHFitter
+
+    cphs = {}
+    fit_stats = {}
+    initial_point = None
+    for p in sorted(penalizers, reverse=True):
+        cph = CoxPHFitter(l1_ratio=l1_ratio, penalizer=p)
+        start = time.time()
+        cph.fit(tr_dataset, duration_col=duration_col, event_col=event_col, step_size=step_size,
+                initial_point=initial_point)
+        fit_stats[p] = {'seconds': time.time() - start}
+        print('penalizer {}: {:.1f}s'.format(p, fit_stats[p]['seconds']))
+        cphs[p] = cph
+        if warm_start:
+            initial_point = (cph.params_ * cph._norm_std).values  # lifelines fits on columns scaled by their std
+    return cphs, fit_stats
+
+
+def fit_coxnet_path(d, tag, penalizers, l1_ratio=1.0):
+    """Coefficients and concordances along penalizers with coxnet, warm-started; saved as models/{tag}_path.pkl.
+
+    With lambda=penalizer and alpha=l1_ratio, coxnet minimizes the objective of CoxPHFitter(penalizer, l1_ratio)
+    with an exact |beta| (and Breslow's instead of Efron's ties), so a dense sweep takes seconds.
+    """
+    from coxnet import coxnet_path
+    from concordance import concordance_index
+
+    penalizers = sorted(penalizers, reverse=True)
+    X_tr, y_tr = d['X_train'], d['y_train']
+    coefs, fit_stats = coxnet_path(X_tr.values, y_tr.iloc[:, 0].values, y_tr.iloc[:, 1].values, penalizers,
+                                   alpha=l1_ratio, return_stats=True)
+    path = {
+        'penalizers': penalizers,
+        'l1_ratio': l1_ratio,
+        'features': list(X_tr.columns),
+        'coefs': coefs,
+        'nfeatures': neq_zero(coefs).sum(axis=1),
+        'fit_seconds': [s['seconds'] for s in fit_stats],
+        'fit_iterations': [s['iterations'] for s in fit_stats],
     }
-    cph_results[best_ps[i]]=summary
-    best_cphs.append(best_cph)
-    plt.rcParams['figure.figsize'] = [5, 10]
-    fig = best_cph.plot()
-    figures.append(fig)
-    plt.close()
-    print(summary)
-    
-with open("{}/{}_summary.pkl".format(model_path, tag), "wb") as fout:
-    pickle.dump(cph_results, fout)
-
-print(cph_results)                          
+    for split, name in [('train', 'C_train'), ('test_eicu', 'C_eicu'), ('test_mimic', 'C_mimic')]:
+        X, y = d['X_' + split], d['y_' + split]
+        eta = X.values.dot(coefs.T)
+        path[name] = [concordance_index(y.iloc[:, 0], -eta[:, k], y.iloc[:, 1]) for k in range(len(penalizers))]
+
+    if not os.path.exists(model_path):
+        os.makedirs(model_path)
+    with open("{}/{}_path.pkl".format(model_path, tag), "wb") as fout:
+        pickle.dump(path, fout)
+    return path
+
+
+def fit_best_models(d, tag, prep, l=1.0, n_boot=0, seed=None):
+    """Fit lifelines models for each of best_ps on the train split; saves a summary and a scorer for each.
+
+    With n_boot, the summaries also have bootstrap intervals of the concordances (C_ci, see get_concordance_cis).
+    """
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from scorer import save_scorer
+
+    X_tr, y_tr = d['X_train'], d['y_train']
+    tr_dataset = combine_Xy(X_tr, y_tr)
+    duration_col = y_tr.columns[0]
+    event_col = y_tr.columns[1]
+
+    if not os.path.exists(model_path):
+        os.makedirs(model_path)
+
+    print('best penalties:', best_ps)
+    cph_results = {}
+    best_cphs = []
+    figures = []
+    cphs, fit_stats = fit_path(tr_dataset, duration_col, event_col, best_ps, l1_ratio=l)
+    for i, p in enumerate(best_ps):
+        best_cph = cphs[p]
+        ctr, ceicu, cmimic = get_concordances(best_cph, X_tr, y_tr, d['X_test_eicu'], d['y_test_eicu'],
+                                              d['X_test_mimic'], d['y_test_mimic'])
+        nzeros = neq_zero(best_cph.params_)
+        coefs = nzeros.index[nzeros.values].to_list()
+        coefs_val = best_cph.params_[nzeros.values].tolist()
+
+        summary = {
+            "penalizer":p,
+            "C_train": ctr,
+            "C_eicu:":ceicu,
+            "C_mimic":cmimic,
+            "nfeatures":len(coefs),
+            "features":coefs,
+            "coefs": coefs_val,
+            "df": pd.DataFrame({"features":coefs, "coefs":coefs_val}),
+            "fit_seconds": fit_stats[p]['seconds'],
+        }
+        if n_boot:
+            summary["C_ci"] = get_concordance_cis(best_cph, X_tr, y_tr, d['X_test_eicu'], d['y_test_eicu'],
+                                                  d['X_test_mimic'], d['y_test_mimic'], n_boot=n_boot, seed=seed)
+        cph_results[best_ps[i]]=summary
+        best_cphs.append(best_cph)
+        save_scorer("{}/{}_p{}_scorer.npz".format(model_path, tag, p), best_cph, prep.layout())
+        plt.rcParams['figure.figsize'] = [5, 10]
+        fig = best_cph.plot()
+        figures.append(fig)
+        plt.close()
+        print(summary)
+
+    save_checked("{}/{}_summary.pkl".format(model_path, tag), cph_results)
+    store_results(tag, cph_results=cph_results, l1_ratio=l)
+
+    print(cph_results)
+    return cph_results, best_cphs, figures
+
+
+def main(argv=None):
+    from preprocess import get_data
+
+    args = parse_args(argv)
+    outcome = args.outcome
+    prefix = args.prefix
+    day = args.day
+    impute = args.impute  # use MissForest
+    seed = args.seed
+    np.random.seed(seed)
+    random.seed(seed)
+
+    d = get_data(seed=seed, prefix=prefix, day=day, impute=impute, outcome=outcome, save=True)
+    tag = get_tag(prefix, day, outcome, seed, impute, args.engine)
+
+    resume = args.resume or use_saved_values
+    grid_search_results = get_grid_search_results(d['X_train'], d['y_train'], seed, tag, args.engine, resume)
+    all_scores = grid_search_results['all_scores']
+    zero_betas = grid_search_results['zero_betas']
+
+    # # Grid search result
+    top3 = summarize_scores(all_scores)[:3]
+    print('top3:', top3)
+
+    plot_grid_search(all_scores, zero_betas, tag)
+    print('penalizer:', penalizers)
+
+    if resume and load_checked("{}/{}_summary.pkl".format(model_path, tag)) is not None:
+        print("final models already fit")
+    else:
+        prep = get_data(seed=seed, prefix=prefix, day=day, impute=impute, outcome=outcome, save=True, return_preprocessor=True)
+        fit_best_models(d, tag, prep, n_boot=args.n_boot, seed=seed)
+    if args.path_penalizers:
+        fit_coxnet_path(d, tag, args.path_penalizers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,22 @@
 """Pre-process the csv output from tables.py in order to output data ready for modeling.
 
 Functionality includes:
-* imputing using MissForest
+* imputing using MissForest or one of the cheaper backends in imputation.py
 * converting categorical and binary variables into one-hot features 
   (dropping the last category to avoid collinearity)
 * scaling numerical values
+
+Splits are read from a typed parquet copy next to each csv when there is one (see save_split), which is
+written the first time a csv is parsed, and are kept in memory for later get_data calls (see load_split).
 """
 
 import argparse
+import hashlib
 import os
 import pickle
 import pprint
+import shutil
+import tempfile
 import warnings
 
 import matplotlib.pyplot as plt
@@ -19,12 +25,18 @@ import pandas as pd
 
 from lifelines.utils import sklearn_adapter, concordance_index
 from lifelines import CoxPHFitter, WeibullAFTFitter
-from missingpy import MissForest
 
 from sklearn.model_selection import GridSearchCV
 from sklearn.preprocessing import StandardScaler
 from sklearn.utils import shuffle
 
+import imputation
+
+try:
+  import pyarrow.parquet as pq
+except ImportError:  # splits are only read from csv
+  pq = None
+
 
 DATA_DIR = '../data/final_splits/'
 SAVE_IMPUTED_DIR = '../data/missforest/'
@@ -47,154 +59,356 @@ EXCLUDE_VARS = [
   'Unnamed: 0', 'fibrinogen', 'ferritin', 'crp', 'smoking', 'd.dimer', 
   'nursing_home', 'chest_xray', 'fio2'
 ]
+OUTCOME_VARS = [
+  'censor_or_deceased_days', 'deceased_indicator', 'censor_or_vasopressor_days',
+  'vasopressor_indicator', 'censor_or_ventilator_days', 'ventilator_indicator'
+]
+ONE_HOT_VARS = ['ethnicity', 'gender']  # expanded into CATEGORICAL_VARS
+DROPPED_LEVELS = ['Other', 'Female']
+# column types of the final splits
+SPLIT_DTYPES = dict([(v, 'float64') for v in NUMERICAL_VARS + OUTCOME_VARS] +
+                    [(v, 'category') for v in ONE_HOT_VARS])
+
+SPLIT_FNAMES = {
+  'train': 'eicu_any2_train.csv',
+  'test_eicu': 'eicu_any2_test.csv',
+  'test_mimic': 'mimic_any2_test.csv',
+  'eicu_viral': 'eicu_viral2_test.csv',
+  'mimic_viral': 'mimic_viral2_test.csv',
+}
+SPLITS = list(SPLIT_FNAMES)
+# overrides of the imputation.make_imputer defaults, per method; for MissForestImputer, n_jobs=-1 fits each forest
+# on all cores and tol=None keeps missingpy's stopping rule
+IMPUTER_PARAMS = {
+  'missforest': {'n_jobs': -1, 'tol': None, 'keep_forests': False},
+}
+CACHE_VERSION = 4  # bump when Preprocessor changes what it produces, to invalidate get_data caches
 
 pd.set_option('display.max_columns', 100)
 
-
-def get_data(seed=42, prefix='viral', day=2, impute=-1, outcome='deceased', save=True, force=False, return_scaler=False):
-  mf_fname = '{}_day{}_{}_seed{}.pkl'.format(prefix, day, outcome, seed)
-  mf_fpath = os.path.join(SAVE_IMPUTED_DIR, mf_fname)
-
-  print(mf_fname)
-
-  if impute == -1:  # missForest
-    if os.path.exists(mf_fpath) and (not force) and (not return_scaler):
-      with open(mf_fpath, 'rb') as fin:
-        print("file:", mf_fpath)
-        d = pickle.load(fin)
-        print('loaded from to {}'.format(mf_fpath))
-        return d
-
-
-  e_tr, e_te, mimic_df, e_viral_df, m_viral_df = load_csv(prefix, day, impute, return_viral=True)
-  e_tr_idxs = list(range(len(e_tr)))
-  e_te_idxs = list(range(len(e_te)))
-  mimic_idxs = list(range(len(mimic_df)))
-
-  e_viral_idxs = list(range(len(e_viral_df)))
-  m_viral_idxs = list(range(len(m_viral_df)))
-  
-  X_train, y_train, scaler, imputer, e_tr_idxs= prepare_data(e_tr, e_tr_idxs, outcome, seed=seed)
-  
-  if return_scaler:
-    return scaler
-
-  X_test_eicu, y_test_eicu, _, _, e_te_idxs = prepare_data(e_te, e_te_idxs, outcome, keep_cols=X_train.columns, scaler=scaler, imputer=imputer)
-  X_test_mimic, y_test_mimic, _, _, mimic_idxs = prepare_data(mimic_df, mimic_idxs, outcome, keep_cols=X_train.columns, scaler=scaler, imputer=imputer)
-
-  X_eicu_viral, y_eicu_viral, _, _, eicu_viral_idxs = prepare_data(e_viral_df, e_viral_idxs, outcome, keep_cols=X_train.columns, scaler=scaler, imputer=imputer)
-  X_mimic_viral, y_mimic_viral, _, _, mimic_viral_idxs = prepare_data(m_viral_df, m_viral_idxs, outcome, keep_cols=X_train.columns, scaler=scaler, imputer=imputer)
+_split_cache = {}  # see load_split
+_file_hashes = {}  # see file_hash
+
+
+def get_data(seed=42, prefix='viral', day=2, impute=-1, outcome='deceased', save=True, force=False, return_scaler=False,
+             splits=None, return_preprocessor=False):
+  """Imputed, scaled (X, y, idxs) for each of SPLITS, as a dict with keys X_<split>, y_<split> and idxs_<split>.
+
+  impute is one of imputation.IMPUTERS, or -1 for MissForest. Results are cached in a directory keyed on the split
+  files' contents, the variable lists and the imputer/scaler configuration (see get_cache_dir), with the fitted
+  Preprocessor, its scaler and each split stored separately: return_scaler and return_preprocessor only read that
+  object and splits selects which splits are read.
+  """
+  impute = impute_method(impute)
+  splits = SPLITS if splits is None else splits
+  fitted = 'scaler' if return_scaler else 'preprocessor' if return_preprocessor else None
+  cache_dir = get_cache_dir(seed, prefix, day, outcome, impute)
+
+  print(os.path.basename(cache_dir))
+
+  if os.path.exists(cache_dir) and (not force):
+    print('loading from {}'.format(cache_dir))
+    if fitted:
+      return load_artifact(cache_dir, fitted)
+    d = {}
+    for split in splits:
+      a = load_artifact(cache_dir, split)
+      d['X_' + split], d['y_' + split], d['idxs_' + split] = a['X'], a['y'], a['idxs']
+    return d
+
+  dfs = dict(zip(SPLITS, load_csv(prefix, day, impute, return_viral=True)))
+
+  prep = Preprocessor(outcome, seed=seed, impute=impute)
+  X_train, y_train, e_tr_idxs = prep.fit_transform(dfs['train'])
+  artifacts = {'preprocessor': prep, 'scaler': prep.scaler, 'train': {'X': X_train, 'y': y_train, 'idxs': e_tr_idxs}}
+
+  if fitted and not save:
+    return artifacts[fitted]
+
+  forests = getattr(prep.imputer, 'forests_', None)
+  for split in SPLITS[1:]:
+    if save or split in splits:
+      X, y, idxs = prep.transform(dfs[split])
+      artifacts[split] = {'X': X, 'y': y, 'idxs': idxs}
+      # the imputer saved with prep (and any warm start from it) must only have seen the training data
+      if getattr(prep.imputer, 'forests_', None) is not forests:
+        raise RuntimeError('transforming {} changed the imputer forests fit on train'.format(split))
+
+  if save:
+    save_artifacts(cache_dir, artifacts)
+    print('saved to {}'.format(cache_dir))
+  if fitted:
+    return artifacts[fitted]
 
   d = {}
-  d['X_train'] = X_train
-  d['y_train'] = y_train
-  d['X_test_eicu'] = X_test_eicu
-  d['y_test_eicu'] = y_test_eicu
-  d['X_test_mimic'] = X_test_mimic
-  d['y_test_mimic'] = y_test_mimic
-  d['X_eicu_viral'] = X_eicu_viral
-  d['y_eicu_viral'] = y_eicu_viral
-  d['X_mimic_viral'] = X_mimic_viral
-  d['y_mimic_viral'] = y_mimic_viral
-  d['idxs_train'] = e_tr_idxs
-  d['idxs_test_eicu'] = e_te_idxs
-  d['idxs_test_mimic'] = mimic_idxs
-  d['idxs_eicu_viral'] = eicu_viral_idxs
-  d['idxs_mimic_viral'] = mimic_viral_idxs
-
-  if (impute == -1) and save:
-    if not os.path.exists(SAVE_IMPUTED_DIR):
-      os.makedirs(SAVE_IMPUTED_DIR)
-    with open(mf_fpath, 'wb') as fout:
-      pickle.dump(d, fout)
-      print('saved to {}'.format(mf_fpath))
+  for split in splits:
+    a = artifacts[split]
+    d['X_' + split], d['y_' + split], d['idxs_' + split] = a['X'], a['y'], a['idxs']
   return d
 
 
+def impute_method(impute):
+  """Name of the imputer selected by an impute argument; -1 (also as a string, from the command line) is MissForest."""
+  return 'missforest' if str(impute) == '-1' else impute
+
+
+def make_imputer(seed=None, impute='missforest'):
+  method = impute_method(impute)
+  return imputation.make_imputer(method, seed, **IMPUTER_PARAMS.get(method, {}))
+
+
+def estimator_config(est):
+  return (type(est).__name__, sorted(est.get_params().items()))
+
+
+def file_hash(fpath):
+  """sha1 of a file's contents, memoized on its path, size and mtime."""
+  st = os.stat(fpath)
+  key = (os.path.abspath(fpath), st.st_size, st.st_mtime_ns)
+  if key not in _file_hashes:
+    h = hashlib.sha1()
+    with open(fpath, 'rb') as fin:
+      for block in iter(lambda: fin.read(1 << 20), b''):
+        h.update(block)
+    _file_hashes[key] = h.hexdigest()
+  return _file_hashes[key]
+
+
+def get_cache_dir(seed, prefix, day, outcome, impute='missforest'):
+  """Cache directory of get_data, named after its arguments plus a hash of everything its output depends on."""
+  h = hashlib.sha1()
+  for fname in SPLIT_FNAMES.values():
+    fpath = os.path.join(DATA_DIR, fname)
+    if not os.path.exists(fpath):
+      fpath = os.path.splitext(fpath)[0] + '.parquet'
+    h.update(file_hash(fpath).encode())
+  for part in [CACHE_VERSION, prefix, day, outcome, seed, CATEGORICAL_VARS, NUMERICAL_VARS, EXCLUDE_VARS,
+               OUTCOME_VARS, ONE_HOT_VARS, DROPPED_LEVELS, estimator_config(make_imputer(seed, impute)),
+               estimator_config(StandardScaler())]:
+    h.update(repr(part).encode())
+  method = impute_method(impute)
+  name = '{}_day{}_{}_seed{}'.format(prefix, day, outcome, seed) + ('' if method == 'missforest' else '_' + method)
+  return os.path.join(SAVE_IMPUTED_DIR, '{}_{}'.format(name, h.hexdigest()[:16]))
+
+
+def load_artifact(cache_dir, name):
+  with open(os.path.join(cache_dir, name + '.pkl'), 'rb') as fin:
+    return pickle.load(fin)
+
+
+def save_artifacts(cache_dir, artifacts):
+  """Pickle each artifact to its own file; the directory is written under a temporary name and renamed into place."""
+  if not os.path.exists(SAVE_IMPUTED_DIR):
+    os.makedirs(SAVE_IMPUTED_DIR)
+  tmp_dir = tempfile.mkdtemp(dir=SAVE_IMPUTED_DIR)
+  for name, obj in artifacts.items():
+    with open(os.path.join(tmp_dir, name + '.pkl'), 'wb') as fout:
+      pickle.dump(obj, fout)
+  if os.path.exists(cache_dir):  # force
+    shutil.rmtree(cache_dir)
+  try:
+    os.rename(tmp_dir, cache_dir)
+  except OSError:  # written by a concurrent run in the meantime
+    shutil.rmtree(tmp_dir)
+
+
+class Preprocessor(object):
+  """The column plan, imputer and scaler of prepare_data, fitted once and applied to any split.
+
+  fit_transform compiles the plan from the training frame: the columns kept after dropping EXCLUDE_VARS,
+  one-hot encoding ONE_HOT_VARS (without DROPPED_LEVELS) and dropping all-zero columns, in order. transform
+  then builds the design matrix of a new frame in one pass: columns it lacks are filled with zeros and the
+  one-hot columns are compared against the category levels at once. Picklable, so that the same object can
+  be reused at scoring time.
+  """
+
+  def __init__(self, outcome, convert_categorical=True, columns=None, imputer=None, scaler=None, seed=None,
+               init_imputer=None, impute='missforest'):
+    self.outcome = outcome
+    self.convert_categorical = convert_categorical
+    self.columns = None if columns is None else list(columns)
+    self.imputer = imputer
+    self.scaler = scaler
+    self.seed = seed
+    self.init_imputer = init_imputer  # warm start, see MissForestImputer.fit
+    self.impute = impute_method(impute)  # imputer fitted if none is given
+    self.time_col = 'censor_or_{}_days'.format(outcome)
+    self.event_col = '{}_indicator'.format(outcome)
+
+  def fit_transform(self, data, data_idxs=None, verbose=False):
+    """Compile the column plan if none was given and fit the imputer and scaler if none were given."""
+    if self.columns is None:
+      self.columns = self._plan(data)
+    self.raw_columns = list(data.columns)
+    self.levels = dict((v, list(data[v].dropna().unique())) for v in ONE_HOT_VARS if v in data.columns)
+    return self._transform(data, data_idxs, fit=True, verbose=verbose)
+
+  def layout(self):
+    """What transform does to each output column, as lists for scorer.save_scorer.
+
+    For each column: its source column in the raw frame, its kind ('value', 'level' for one-hot columns, 'missing'
+    for missing-value indicators or 'zero' for columns the training frame lacked), the one-hot level, the imputer's
+    fill value and the scaler's mean and scale (0 and 1 for unscaled columns).
+    """
+    fill = dict(zip(self.columns, imputation.fill_values(self.imputer)))
+    scaled = dict(zip(NUMERICAL_VARS, zip(self.scaler.mean_, self.scaler.scale_)))
+    layout = dict((k, []) for k in ['columns', 'sources', 'kinds', 'levels', 'fill', 'mean', 'scale'])
+    n_columns = len(self.columns)
+    for i, c in enumerate(imputation.imputed_columns(self.imputer, self.columns)):
+      source, level = c, ''
+      if i >= n_columns:
+        source, kind = self.columns[self.imputer.indicator_.features_[i - n_columns]], 'missing'
+      elif c in self.raw_columns:
+        kind = 'value'
+      else:
+        hot = [v for v in self.levels if c in self.levels[v]]
+        source, kind, level = (hot[0], 'level', c) if hot else (c, 'zero', '')
+      mean, scale = scaled.get(c, (0.0, 1.0))
+      for (k, v) in zip(['columns', 'sources', 'kinds', 'levels', 'fill', 'mean', 'scale'],
+                        [c, source, kind, level, fill.get(c, 0.0), mean, scale]):
+        layout[k].append(v)
+    return layout
+
+  def transform(self, data, data_idxs=None, verbose=False):
+    return self._transform(data, data_idxs, fit=False, verbose=verbose)
+
+  def _plan(self, data):
+    X_cols = data.columns[:-6]  # TODO: get rid of magic number
+    for v in EXCLUDE_VARS:
+      if v in X_cols:
+        print('dropped {} column...'.format(v))
+    columns = [c for c in X_cols if c not in EXCLUDE_VARS]
+    if self.convert_categorical:
+      columns = [c for c in columns if c not in ONE_HOT_VARS]
+      for v in ONE_HOT_VARS:
+        if isinstance(data[v].dtype, pd.CategoricalDtype):
+          levels = list(data[v].cat.categories)
+        else:
+          levels = sorted(data[v].dropna().unique())
+        columns += [l for l in levels if l not in DROPPED_LEVELS]  # to avoid colinearity
+
+    # drop columns w/ all zero
+    X = self._design(data.loc[(data[self.time_col] > 0).values], columns)
+    return [c for (c, nonzero) in zip(columns, (X != 0).any(axis=0)) if nonzero]
+
+  def _design(self, data, columns):
+    """Float matrix of data in the given column order; absent columns are zero unless they are one-hot levels."""
+    X = data.reindex(columns=columns, fill_value=0.0).to_numpy(dtype=float)
+    hot_idxs = [i for (i, c) in enumerate(columns) if c not in data.columns]
+    if self.convert_categorical and hot_idxs:
+      levels = np.array([columns[i] for i in hot_idxs], dtype=object)
+      hot = np.zeros((len(data), len(levels)), dtype=bool)
+      for v in ONE_HOT_VARS:
+        hot |= data[v].to_numpy(dtype=object)[:, None] == levels[None, :]
+      X[:, hot_idxs] = hot
+    return X
+
+  def _transform(self, data, data_idxs, fit, verbose):
+    if data_idxs is None:
+      data_idxs = range(len(data))
+
+    ## Filter for appropriate samples
+    pos_events = (data[self.time_col] > 0).values  # event times > 0
+    data = data.loc[pos_events]
+    y = data[[self.time_col, self.event_col]]
+    data_idxs = list([i for (i, inc) in zip(data_idxs, pos_events) if inc])
+    print('filtered out {} events with times < 0'.format(len(pos_events) - len(y)))
+
+    X = pd.DataFrame(data=self._design(data, self.columns), columns=self.columns)
+
+    # check for nulls and impute
+    x_null = np.sum(pd.isnull(X))
+    y_null = np.sum(pd.isnull(y))
+    if (x_null.sum() > 0) or (y_null.sum() > 0):
+      print('Will impute...')
+      print('NULL (X, y):', x_null, y_null)
+    if fit and self.imputer is None:
+      print('Fitting {} imputer...'.format(self.impute))
+      self.imputer = make_imputer(self.seed, self.impute)
+      fit_params = {} if self.init_imputer is None else {'init': self.init_imputer}
+      X_data = self.imputer.fit_transform(X, **fit_params)
+      print('Fitted.')
+    else:
+      X_data = self.imputer.transform(X)
+    X = pd.DataFrame(data=X_data, columns=imputation.imputed_columns(self.imputer, self.columns))
+
+    # scale numerical values
+    if fit and self.scaler is None:
+      self.scaler = StandardScaler()
+      X[NUMERICAL_VARS] = self.scaler.fit_transform(X[NUMERICAL_VARS])
+    else:
+      X[NUMERICAL_VARS] = self.scaler.transform(X[NUMERICAL_VARS])
+
+    if verbose:
+      print('X.shape: {}, y.shape: {}'.format(X.shape, y.shape))
+      print('Columns: {}'.format(X.columns))
+      print('---------------- X ----------------\n{}'.format(X.describe()))
+      print('---------------- y ----------------\n{}'.format(y.describe()))
+
+    return X, y, data_idxs
+
+
 def prepare_data(data, data_idxs, outcome, convert_categorical=True, 
                  keep_cols=None, scaler=None, imputer=None, verbose=False, seed=None):
-  X = data.iloc[:, 0:-6]  # TODO: get rid of magic number
-
-  # remove excluded variables
-  for v in EXCLUDE_VARS:
-    if v in X.columns:
-      print('dropped {} column...'.format(v))
-      X = X.drop([v], axis=1)
-
-  # convert categorical variables
-  if convert_categorical:
-    X = pd.concat([X, pd.get_dummies(X['ethnicity'])], axis=1)
-    X = pd.concat([X, pd.get_dummies(X['gender'])], axis=1)
-    X = X.drop(['ethnicity', 'gender'], axis=1)
-    X = X.drop(['Other', 'Female'], axis=1)  # to avoid colinearity
-  
-  ## Extract outcomes
-  y = None
-  names = {
-    'time': 'censor_or_{}_days'.format(outcome), 
-    'event': '{}_indicator'.format(outcome),
-  }
-  y = data[[names['time'], names['event']]]
-
-  ## Filter for appropriate samples
-  prev_ct = len(y)
-  pos_events = y.iloc[:, 0] > 0  # event times > 0
-  X = X.loc[pos_events]
-  y = y.loc[pos_events]
-  data_idxs = list([i for (i, inc) in zip(data_idxs, pos_events.tolist()) if inc])
-  print('filtered out {} events with times < 0'.format(prev_ct - len(y)))
-  
-  if keep_cols is None:
-    X = X.loc[:, (X != 0).any(axis=0)]  # drop columns w/ all zero
-  else:
-    for vr in keep_cols:
-      if not set([vr]).issubset(X.columns):
-        X[vr] = 0.0  # impute with zero by default
-    X = X[keep_cols]
-
-  # check for nulls and impute
-  x_null = np.sum(pd.isnull(X))
-  y_null = np.sum(pd.isnull(y))
-  if (x_null.sum() > 0) or (y_null.sum() > 0):
-    print('Will impute...')
-    print('NULL (X, y):', x_null, y_null)
-  if imputer is None:
-    print('Fitting MissForest...')
-    imputer = MissForest(random_state=seed)
-    X_data = imputer.fit_transform(X)
-    X = pd.DataFrame(data=X_data, columns=X.columns)
-    print('Fitted.')
+  """Functional interface to Preprocessor; fits whichever of keep_cols, scaler and imputer is not given."""
+  prep = Preprocessor(outcome, convert_categorical=convert_categorical, columns=keep_cols, imputer=imputer,
+                      scaler=scaler, seed=seed)
+  X, y, data_idxs = prep.fit_transform(data, data_idxs, verbose=verbose)
+  return X, y, prep.scaler, prep.imputer, data_idxs
+
+
+def save_split(df, fpath, csv=False):
+  """Write a split as parquet next to its csv (if pyarrow is installed), typed according to SPLIT_DTYPES; with
+  csv, also write the csv itself."""
+  if csv:
+    df.to_csv(fpath, index=False, sep=',')
+  if pq is not None:
+    df = df.astype({c: t for (c, t) in SPLIT_DTYPES.items() if c in df.columns})
+    df.to_parquet(os.path.splitext(fpath)[0] + '.parquet', index=False)
+
+
+def read_split(fpath, exclude=EXCLUDE_VARS, persist=False):
+  """Read a split without its excluded columns, typed according to SPLIT_DTYPES.
+
+  If there is a parquet copy at least as recent as the csv, only the needed columns are read from it
+  (memory-mapped); otherwise the csv is parsed, and with persist a parquet copy is saved for later runs.
+  """
+  pq_fpath = os.path.splitext(fpath)[0] + '.parquet'
+  if pq is not None and os.path.exists(pq_fpath) and \
+      (not os.path.exists(fpath) or os.path.getmtime(pq_fpath) >= os.path.getmtime(fpath)):
+    columns = [c for c in pq.read_schema(pq_fpath).names if c not in exclude]
+    df = pq.read_table(pq_fpath, columns=columns, memory_map=True).to_pandas()
+  elif persist and pq is not None:
+    df = pd.read_csv(fpath)
+    save_split(df, fpath)  # with every column, so that it can serve any exclude list
+    print('saved {}'.format(os.path.splitext(fpath)[0] + '.parquet'))
+    df = df.drop([c for c in exclude if c in df.columns], axis=1)
   else:
-    X_data = imputer.transform(X)
-    X = pd.DataFrame(data=X_data, columns=X.columns)
+    df = pd.read_csv(fpath, usecols=lambda c: c not in exclude)
+  return df.astype({c: t for (c, t) in SPLIT_DTYPES.items() if c in df.columns})
 
-  # scale numerical values
-  if scaler is None:
-    scaler = StandardScaler()
-    X[NUMERICAL_VARS] = scaler.fit_transform(X[NUMERICAL_VARS])
-  else:
-    X[NUMERICAL_VARS] = scaler.transform(X[NUMERICAL_VARS])
 
-  if verbose:
-    print('X.shape: {}, y.shape: {}'.format(X.shape, y.shape))
-    print('Columns: {}'.format(X.columns))
-    print('---------------- X ----------------\n{}'.format(X.describe()))
-    print('---------------- y ----------------\n{}'.format(y.describe()))
+def load_split(fpath, exclude=EXCLUDE_VARS, persist=True):
+  """read_split, memoized for the lifetime of the process.
 
-  return X, y, scaler, imputer, data_idxs
+  Entries are keyed on the file's path, size and mtime, so a rewritten split is read again. Callers get
+  a copy and are free to modify it.
+  """
+  src = fpath if os.path.exists(fpath) else os.path.splitext(fpath)[0] + '.parquet'
+  st = os.stat(src)
+  key = (os.path.abspath(src), st.st_size, st.st_mtime_ns, tuple(exclude))
+  if key not in _split_cache:
+    _split_cache[key] = read_split(fpath, exclude=exclude, persist=persist)
+  return _split_cache[key].copy()
 
 
 def load_csv(prefix, day, impute, return_viral=False):
-  assert(impute == -1)
+  assert(impute_method(impute) in imputation.IMPUTERS)
   assert(day == 2)
   assert(prefix == 'any')
 
-  eicu_tr_df = pd.read_csv(os.path.join(DATA_DIR, 'eicu_any2_train.csv'))
-  eicu_te_df = pd.read_csv(os.path.join(DATA_DIR, 'eicu_any2_test.csv'))
-  mimic_df = pd.read_csv(os.path.join(DATA_DIR, 'mimic_any2_test.csv'))
-  mimic_df = pd.read_csv(os.path.join(DATA_DIR, 'mimic_any2_test.csv'))
-  eicu_viral_df = pd.read_csv(os.path.join(DATA_DIR, 'eicu_viral2_test.csv'))
-  mimic_viral_df = pd.read_csv(os.path.join(DATA_DIR, 'mimic_viral2_test.csv'))
+  eicu_tr_df, eicu_te_df, mimic_df, eicu_viral_df, mimic_viral_df = [
+    load_split(os.path.join(DATA_DIR, SPLIT_FNAMES[split])) for split in SPLITS]
 
   if return_viral:
     return eicu_tr_df, eicu_te_df, mimic_df, eicu_viral_df, mimic_viral_df
@@ -203,10 +417,20 @@ def load_csv(prefix, day, impute, return_viral=False):
 
 
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--impute', default=-1, action="store",
+                      help='-1 (MissForest) or one of {}'.format(', '.join(imputation.IMPUTERS)))
+  parser.add_argument('--n_jobs', type=int, default=IMPUTER_PARAMS['missforest']['n_jobs'], action="store",
+                      help='cores per MissForest forest fit (-1: all)')
+  parser.add_argument('--tol', type=float, default=IMPUTER_PARAMS['missforest']['tol'], action="store",
+                      help='stop MissForest once the relative change of the imputed values is below this')
+  args = parser.parse_args()
+  IMPUTER_PARAMS['missforest'].update(n_jobs=args.n_jobs, tol=args.tol)
+
   outcome = 'deceased'
   prefix = 'any'
   day = 2
-  impute = -1  # use MissForest
+  impute = args.impute  # -1: use MissForest
   seed = 42
 
   #load_csv(prefix, day, impute)
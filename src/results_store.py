@@ -0,0 +1,174 @@
+"""SQLite store of grid search and final model results, one row per (prefix, day, outcome, seed, penalizer, l1_ratio).
+
+pipeline.py appends every run's results here (results.sqlite, next to grid_out/ and models/), alongside its
+pickles. Rows are only ever inserted: a rerun adds new rows, and reads return the latest row of each key. Writes
+are single transactions in WAL mode, so concurrent runs (run_grid_search.sh, grid_runner.py) can share a store,
+and the key columns are indexed, so aggregating a sweep is one query instead of unpickling every run:
+
+  store = ResultStore('results.sqlite')
+  store.grid(outcome='deceased')             # cvm, cvsd, nzero of every seed and penalizer
+  store.grid_summary(outcome='deceased')      # the same, averaged over seeds
+  store.models(penalizer=0.02)                # concordances of the final models
+  store.coefs(penalizer=0.02)                 # their nonzero coefficients
+
+Existing pickles can be loaded with: python results_store.py --import grid_out models
+
+The store is row-oriented SQLite rather than columnar files (e.g. parquet per table): appending from several
+processes at once and indexed reads of one key need a lock and an index, which SQLite provides in the standard
+library, whereas parquet files are immutable (every run would add a file, or rewrite a shared one) and pyarrow is
+only an optional dependency here. The tables are narrow (a few numbers per key), and the queries above read every
+matching row anyway, so they stay fast at the size of a thousand-seed sweep.
+"""
+
+import argparse
+import glob
+import os
+import pickle
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+
+KEY = ['prefix', 'day', 'outcome', 'seed', 'impute', 'engine', 'penalizer', 'l1_ratio']
+
+TABLES = {
+  'grid': ['cvm REAL', 'cvsd REAL', 'nzero INTEGER'],
+  'models': ['c_train REAL', 'c_eicu REAL', 'c_mimic REAL', 'nfeatures INTEGER', 'fit_seconds REAL'],
+  'coefs': ['feature TEXT', 'coef REAL'],
+}
+KEY_TYPES = ['prefix TEXT', 'day INTEGER', 'outcome TEXT', 'seed INTEGER', 'impute TEXT', 'engine TEXT',
+             'penalizer REAL', 'l1_ratio REAL']
+
+
+class ResultStore(object):
+
+  def __init__(self, path='results.sqlite', timeout=60):
+    self.path = path
+    self.conn = sqlite3.connect(path, timeout=timeout)
+    self.conn.execute('PRAGMA journal_mode=WAL')
+    with self.conn:
+      for table, columns in TABLES.items():
+        self.conn.execute('CREATE TABLE IF NOT EXISTS {} ({}, created REAL)'.format(
+          table, ', '.join(KEY_TYPES + columns)))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS {0}_key ON {0} ({1})'.format(table, ', '.join(KEY)))
+
+  def close(self):
+    self.conn.close()
+
+  def _insert(self, table, rows):
+    columns = KEY + [c.split()[0] for c in TABLES[table]] + ['created']
+    created = time.time()
+    with self.conn:
+      self.conn.executemany('INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns),
+                                                                 ', '.join('?' * len(columns))),
+                            [[row.get(c) for c in columns[:-1]] + [created] for row in rows])
+
+  def add_grid(self, run, grid_search_results):
+    """Append pipeline's grid search results (all_scores and zero_betas) of run, a dict of KEY[:6] values."""
+    rows = []
+    for scores in [grid_search_results['all_scores'], grid_search_results['zero_betas']]:
+      for ((penalizer, l1_ratio), s) in scores.items():
+        rows.append(dict(_run_key(run), penalizer=penalizer, l1_ratio=l1_ratio, cvm=float(s['scores']),
+                         cvsd=float(s['std']), nzero=int(s['n_nonzero'])))
+    self._insert('grid', rows)
+
+  def add_models(self, run, cph_results, l1_ratio=1.0):
+    """Append pipeline's final model summaries (by penalizer) of run, and their nonzero coefficients."""
+    rows = []
+    coef_rows = []
+    for (penalizer, summary) in cph_results.items():
+      key = dict(_run_key(run), penalizer=penalizer, l1_ratio=l1_ratio)
+      rows.append(dict(key, c_train=summary['C_train'], c_eicu=summary['C_eicu:'], c_mimic=summary['C_mimic'],
+                       nfeatures=summary['nfeatures'], fit_seconds=summary.get('fit_seconds')))
+      coef_rows.extend(dict(key, feature=f, coef=c) for (f, c) in zip(summary['features'], summary['coefs']))
+    self._insert('models', rows)
+    self._insert('coefs', coef_rows)
+
+  def _select(self, table, where, latest_of):
+    """Rows of table matching where (column=value), keeping the latest insert of each latest_of key."""
+    conditions = ' AND '.join('{} = ?'.format(c) for c in where)
+    params = [_sql_value(c, v) for (c, v) in where.items()]
+    query = 'SELECT * FROM {0} WHERE {1} created = (SELECT max(created) FROM {0} AS latest WHERE {2})'.format(
+      table, conditions + ' AND' if where else '', ' AND '.join('latest.{0} IS {1}.{0}'.format(c, table)
+                                                                  for c in latest_of))
+    return pd.read_sql_query(query, self.conn, params=params)
+
+  def grid(self, **where):
+    return self._select('grid', where, KEY)
+
+  def models(self, **where):
+    return self._select('models', where, KEY)
+
+  def coefs(self, **where):
+    return self._select('coefs', where, KEY)
+
+  def grid_summary(self, **where):
+    """Mean and standard deviation over seeds of the grid search results, by penalizer and l1_ratio."""
+    df = self.grid(**where)
+    summary = df.groupby(['penalizer', 'l1_ratio']).agg(
+      n_seeds=('seed', 'nunique'), cvm=('cvm', 'mean'), cvm_std=('cvm', 'std'), nzero=('nzero', 'mean'))
+    return summary.sort_index(ascending=[False, True]).reset_index()
+
+
+def _run_key(run):
+  return dict((c, _sql_value(c, run.get(c, default))) for (c, default) in
+              zip(KEY[:6], [None, None, None, None, -1, 'glmnet']))
+
+
+def _sql_value(column, value):
+  # impute is -1, '-1' or an imputer name: store it as text
+  return str(value) if column == 'impute' else value
+
+
+def parse_tag(tag):
+  """The run (KEY[:6] values) of a tag made by pipeline.get_tag."""
+  import pipeline
+  m = re.match(r'^(?P<prefix>.+?)_day(?P<day>\d+)_(?P<outcome>.+)_seed(?P<seed>\d+)_(?:cvglmnet|l1_search)'
+               r'(?:_(?P<rest>.+))?$', tag)
+  if m is None:
+    raise ValueError('not a pipeline tag: {}'.format(tag))
+  run = {'prefix': m.group('prefix'), 'day': int(m.group('day')), 'outcome': m.group('outcome'),
+         'seed': int(m.group('seed')), 'impute': -1, 'engine': 'glmnet'}
+  rest = m.group('rest')
+  for engine in pipeline.ENGINES:
+    if rest is not None and (rest == engine or rest.endswith('_' + engine)):
+      run['engine'] = engine
+      rest = rest[:-len(engine)].rstrip('_') or None
+  if rest is not None:
+    run['impute'] = rest
+  return run
+
+
+def import_pickles(store, grid_path='grid_out', model_path='models'):
+  """Load the grid search and summary pickles written by pipeline.py into store; returns the number of files."""
+  n = 0
+  for (path, suffix, add) in [(grid_path, '_grid_search.pkl', store.add_grid),
+                              (model_path, '_summary.pkl', store.add_models)]:
+    for fname in sorted(glob.glob(os.path.join(path, '*' + suffix))):
+      try:
+        run = parse_tag(os.path.basename(fname)[:-len(suffix)])
+      except ValueError as e:
+        print('skipping {}: {}'.format(fname, e))
+        continue
+      with open(fname, 'rb') as fin:
+        add(run, pickle.load(fin))
+      n += 1
+  return n
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='result store of pipeline.py')
+  parser.add_argument('--store', default='results.sqlite', action="store")
+  parser.add_argument('--import', dest='import_dirs', nargs=2, metavar=('GRID_PATH', 'MODEL_PATH'), default=None,
+                      action="store", help='load the pickles of these grid_out and models directories')
+  parser.add_argument('--outcome', default=None, action="store")
+  args = parser.parse_args()
+
+  store = ResultStore(args.store)
+  if args.import_dirs:
+    print('imported {} files'.format(import_pickles(store, *args.import_dirs)))
+  where = {} if args.outcome is None else {'outcome': args.outcome}
+  print(store.grid_summary(**where).round(4).to_string())
+  store.close()
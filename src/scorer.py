@@ -0,0 +1,98 @@
+"""Score patients with a fitted PEER Cox model, using numpy only.
+
+save_scorer exports a fitted CoxPHFitter and the Preprocessor its training data came from (see
+preprocess.Preprocessor.layout) to an .npz file; Scorer loads it and computes partial hazards, equal to
+lifelines' predict_partial_hazard, for any number of raw rows at once. Only the features with a nonzero
+coefficient are kept, and the scaler and lifelines' centering are folded into the weights, so that scoring is
+a single matrix-vector product.
+
+Missing values are filled with the imputer's fill values (the training means for MissForest) instead of being
+imputed by refitting the imputer, so rows with missing values can score slightly differently than in
+pipeline.py.
+
+  scorer = Scorer.load('models/any_day2_deceased_seed499_cvglmnet_p0.025_scorer.npz')
+  scorer.score({'age': 64, 'bun': 31, 'gender': 'Male', ...})  # one patient
+  scorer.score(df)  # a DataFrame (or a dict of columns, or a list of dicts) of raw rows
+"""
+
+import numpy as np
+
+
+def save_scorer(fname, cph, layout):
+  """Save the nonzero-coefficient features of cph, with the layout of the Preprocessor it was trained on."""
+  params = dict(zip(cph.params_.index, np.asarray(cph.params_, dtype=np.float64)))
+  norm_mean = dict(zip(cph._norm_mean.index, np.asarray(cph._norm_mean, dtype=np.float64)))
+  keep = [i for (i, c) in enumerate(layout['columns']) if params.get(c, 0.0) != 0.0]
+  arrays = dict((k, np.asarray([layout[k][i] for i in keep])) for k in ['columns', 'sources', 'kinds', 'levels'])
+  for k in ['fill', 'mean', 'scale']:
+    arrays[k] = np.asarray([layout[k][i] for i in keep], dtype=np.float64)
+  arrays['coefs'] = np.asarray([params[c] for c in arrays['columns']], dtype=np.float64)
+  arrays['offset'] = np.float64(sum(params[c] * norm_mean[c] for c in params))
+  np.savez(fname, **arrays)
+
+
+class Scorer(object):
+
+  def __init__(self, columns, sources, kinds, levels, fill, mean, scale, coefs, offset):
+    self.columns = list(columns)
+    self.sources = list(sources)
+    self.kinds = list(kinds)
+    self.levels = list(levels)
+    self.fill = np.asarray(fill, dtype=np.float64)
+    self.coefs = np.asarray(coefs, dtype=np.float64)
+    # coefs . ((x - mean) / scale) - offset == weights . x + intercept
+    self.weights = self.coefs / np.asarray(scale, dtype=np.float64)
+    self.intercept = float(-np.dot(self.weights, mean) - offset)
+
+  @classmethod
+  def load(cls, fname):
+    with np.load(fname, allow_pickle=False) as f:
+      return cls(**dict((k, f[k]) for k in f.files))
+
+  def design(self, rows):
+    """Float matrix of the scorer's features for raw rows, with nan where a value is missing."""
+    if isinstance(rows, dict):
+      if np.ndim(next((rows[k] for k in self.sources if k in rows), None)) == 0:
+        return self._design_one(rows)
+      rows = dict((k, np.atleast_1d(v)) for (k, v) in rows.items())
+    elif isinstance(rows, (list, tuple)):
+      rows = dict((k, [r.get(k) for r in rows]) for k in set(self.sources))
+    present = [k for k in self.sources if k in rows]
+    X = np.full((len(rows[present[0]]) if present else 1, len(self.columns)), np.nan)
+    for j, (source, kind, level) in enumerate(zip(self.sources, self.kinds, self.levels)):
+      if kind == 'zero':
+        X[:, j] = 0.0
+      elif source not in rows:
+        # as in Preprocessor._design, a missing category sets none of its levels
+        X[:, j] = 1.0 if kind == 'missing' else 0.0 if kind == 'level' else np.nan
+      elif kind == 'level':
+        X[:, j] = np.asarray(rows[source], dtype=object) == level
+      else:
+        values = np.asarray(rows[source], dtype=np.float64)  # None becomes nan
+        X[:, j] = np.isnan(values) if kind == 'missing' else values
+    return X
+
+  def _design_one(self, row):
+    """design for a single patient given as a dict of scalars, without building per-column arrays."""
+    x = np.empty((1, len(self.columns)))
+    for j, (source, kind, level) in enumerate(zip(self.sources, self.kinds, self.levels)):
+      v = row.get(source)
+      missing = v is None or v != v
+      if kind == 'zero':
+        x[0, j] = 0.0
+      elif kind == 'level':
+        x[0, j] = 0.0 if missing else v == level
+      elif kind == 'missing':
+        x[0, j] = missing
+      else:
+        x[0, j] = np.nan if missing else v
+    return x
+
+  def log_partial_hazard(self, rows):
+    X = self.design(rows)
+    X = np.where(np.isnan(X), self.fill, X)
+    return X.dot(self.weights) + self.intercept
+
+  def score(self, rows):
+    """Partial hazards of raw rows: a dict for one patient, or a DataFrame, dict of columns or list of dicts."""
+    return np.exp(self.log_partial_hazard(rows))
@@ -0,0 +1,132 @@
+"""Bootstrap stability of the features selected by the final L1 Cox models of pipeline.py.
+
+The model is refit on n_boot bootstrap resamples of the train split, on a process pool, for each penalizer, and
+for each feature the selection frequency (fraction of resamples with a nonzero coefficient) and a percentile
+interval of its coefficient are reported. Every fit starts from the coefficients of the fit on the whole train
+split. With the default coxnet engine (see coxnet.py) a resample takes tens of milliseconds, so B=1000 takes
+minutes; --engine lifelines refits CoxPHFitter itself, as in pipeline.py, at a few seconds per fit and core.
+
+  python stability.py --seed 499 --outcome deceased --penalizers 0.025 0.02 --n_boot 1000 --workers 8
+"""
+
+import argparse
+import os
+import pickle
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+from coxnet import coxnet_path
+
+
+ENGINES = ['coxnet', 'lifelines']
+
+_data = {}
+
+
+def init_worker(X, time, event, columns, penalizers, l1_ratio, init, engine, seed):
+  _data.update(X=X, time=time, event=event, columns=columns, penalizers=penalizers, l1_ratio=l1_ratio, init=init,
+               engine=engine, seed=seed)
+
+
+def resample(b, n, seed):
+  """Row indices of bootstrap resample b, the same whichever worker draws it."""
+  return np.random.RandomState([seed, b]).randint(0, n, size=n)
+
+
+def fit_resample(b):
+  """Coefficients (penalizers x features) fit on bootstrap resample b."""
+  X, time, event = _data['X'], _data['time'], _data['event']
+  idx = resample(b, len(time), _data['seed'])
+  if _data['engine'] == 'coxnet':
+    return coxnet_path(X[idx], time[idx], event[idx], _data['penalizers'], alpha=_data['l1_ratio'],
+                       init=_data['init'][0])
+
+  from lifelines import CoxPHFitter
+  dataset = pd.DataFrame(X[idx], columns=_data['columns'])
+  dataset['time'] = time[idx]
+  dataset['event'] = event[idx]
+  coefs = []
+  for (p, init) in zip(_data['penalizers'], _data['init']):
+    cph = CoxPHFitter(l1_ratio=_data['l1_ratio'], penalizer=p)
+    cph.fit(dataset, duration_col='time', event_col='event', step_size=0.15,
+            initial_point=init * dataset[_data['columns']].std().values)
+    coefs.append(cph.params_.values)
+  return np.array(coefs)
+
+
+def stability(X_tr, y_tr, penalizers, l1_ratio=1.0, n_boot=1000, seed=None, workers=None, engine='coxnet',
+              alpha=0.05):
+  """Selection frequency and bootstrap interval of each feature's coefficient, as a DataFrame by penalizer.
+
+  The DataFrames are indexed by feature and sorted by selection frequency, with the coefficient of the fit on all
+  of X_tr, y_tr (coef), the selection frequency (selected), and the mean, alpha/2 and 1 - alpha/2 percentiles of
+  the bootstrap coefficients (mean, lower, upper).
+  """
+  penalizers = sorted(penalizers, reverse=True)
+  X = X_tr.values.astype(np.float64)
+  time = y_tr.iloc[:, 0].values.astype(np.float64)
+  event = y_tr.iloc[:, 1].values.astype(np.float64)
+  columns = list(X_tr.columns)
+  if engine == 'coxnet':
+    full = coxnet_path(X, time, event, penalizers, alpha=l1_ratio)
+  else:
+    cphs, _ = pipeline.fit_path(pipeline.combine_Xy(X_tr, y_tr), y_tr.columns[0], y_tr.columns[1], penalizers,
+                                l1_ratio=l1_ratio)
+    full = np.array([cphs[p].params_.values for p in penalizers])
+
+  if seed is None:  # every worker must draw from the same seed (see resample)
+    seed = np.random.randint(2 ** 31)
+  initargs = (X, time, event, columns, penalizers, l1_ratio, full, engine, seed)
+  with Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+    boot = []
+    for coefs in pool.imap(fit_resample, range(n_boot)):
+      boot.append(coefs)
+      if len(boot) % 100 == 0:
+        print('{}/{} resamples'.format(len(boot), n_boot))
+  boot = np.array(boot)  # resamples x penalizers x features
+
+  results = {}
+  for k, p in enumerate(penalizers):
+    lower, upper = np.percentile(boot[:, k], [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    results[p] = pd.DataFrame({
+      'coef': full[k],
+      'selected': pipeline.neq_zero(boot[:, k]).mean(axis=0),
+      'mean': boot[:, k].mean(axis=0),
+      'lower': lower,
+      'upper': upper,
+    }, index=columns).sort_values('selected', ascending=False)
+  return results
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='bootstrap stability of the selected features')
+  parser.add_argument('--outcome', default="deceased", action="store")
+  parser.add_argument('--prefix', default="any", action="store")
+  parser.add_argument('--day', type=int, default=2, action="store")
+  parser.add_argument('--impute', default=-1, action="store")
+  parser.add_argument('--seed', type=int, default=499, action="store")
+  parser.add_argument('--penalizers', type=float, nargs='+', default=pipeline.best_ps, action="store")
+  parser.add_argument('--l1_ratio', type=float, default=1.0, action="store")
+  parser.add_argument('--n_boot', type=int, default=1000, action="store")
+  parser.add_argument('--workers', type=int, default=None, action="store", help='default: all cores')
+  parser.add_argument('--engine', default="coxnet", choices=ENGINES, action="store")
+  args = parser.parse_args()
+
+  from preprocess import get_data
+  d = get_data(seed=args.seed, prefix=args.prefix, day=args.day, impute=args.impute, outcome=args.outcome, save=True)
+  results = stability(d['X_train'], d['y_train'], args.penalizers, args.l1_ratio, args.n_boot, args.seed,
+                      args.workers, args.engine)
+
+  tag = pipeline.get_tag(args.prefix, args.day, args.outcome, args.seed, args.impute)
+  if not os.path.exists(pipeline.model_path):
+    os.makedirs(pipeline.model_path)
+  fname = "{}/{}_{}_stability.pkl".format(pipeline.model_path, tag, args.engine)
+  with open(fname, "wb") as fout:
+    pickle.dump(results, fout)
+  for p, df in results.items():
+    print('penalizer {}:'.format(p))
+    print(df[df['selected'] > 0].round(4).to_string())
+  print('saved {}'.format(fname))
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lifelines import CoxPHFitter
+
+from preprocess import NUMERICAL_VARS, ONE_HOT_VARS, OUTCOME_VARS, Preprocessor
+from scorer import Scorer, save_scorer
+
+
+LEVELS = {
+  'ethnicity': ['African American', 'Asian', 'Caucasian', 'Hispanic', 'Other'],
+  'gender': ['Female', 'Male'],
+}
+
+
+def make_split(n, seed):
+  """A frame laid out like the final splits: features, then the outcome columns."""
+  rs = np.random.RandomState(seed)
+  data = dict((v, rs.normal(size=n).round(3)) for v in NUMERICAL_VARS)
+  for v in NUMERICAL_VARS[:10]:
+    data[v][rs.uniform(size=n) < 0.2] = np.nan
+  for v in ONE_HOT_VARS:
+    data[v] = rs.choice(LEVELS[v], size=n).astype(object)
+    data[v][rs.uniform(size=n) < 0.1] = np.nan
+  data['smoking'] = rs.randint(0, 2, size=n)  # dropped (EXCLUDE_VARS)
+  time = rs.exponential(np.exp(-0.5 * data['age'] - (data['gender'] == 'Male')))
+  for outcome in ['deceased', 'vasopressor', 'ventilator']:
+    data['censor_or_{}_days'.format(outcome)] = time
+    data['{}_indicator'.format(outcome)] = (rs.uniform(size=n) < 0.7).astype(float)
+  columns = [v for v in data if v not in OUTCOME_VARS] + OUTCOME_VARS
+  return pd.DataFrame(data, columns=columns)
+
+
+@pytest.fixture(scope='module')
+def fitted(tmp_path_factory):
+  # IterativeImputer fills with the training means, so a one-hot level filled like a missing value would be
+  # fractional
+  prep = Preprocessor('deceased', seed=0, impute='iterative_linear')
+  X, y, _ = prep.fit_transform(make_split(400, 0))
+  dataset = X.copy()
+  dataset['T'] = y.iloc[:, 0].values
+  dataset['E'] = y.iloc[:, 1].values
+  cph = CoxPHFitter(penalizer=0.1, l1_ratio=0.0).fit(dataset, 'T', 'E')
+  fname = str(tmp_path_factory.mktemp('scorer') / 'scorer.npz')
+  save_scorer(fname, cph, prep.layout())
+  return prep, cph, Scorer.load(fname)
+
+
+def complete_rows(prep, n=30):
+  """Raw rows without missing numerical values (which the scorer fills instead of imputing), with categories."""
+  layout = prep.layout()
+  fill = dict((s, f) for (s, k, f) in zip(layout['sources'], layout['kinds'], layout['fill']) if k == 'value')
+  rows = make_split(n, 1).fillna(value=fill)
+  return rows[rows[prep.time_col] > 0]
+
+
+def expected(prep, cph, rows):
+  return cph.predict_partial_hazard(prep.transform(rows)[0]).values
+
+
+def check(scorer, rows, expected):
+  np.testing.assert_allclose(scorer.score(rows), expected)
+  np.testing.assert_allclose(scorer.score(rows.to_dict('records')), expected)
+  for i in range(3):
+    np.testing.assert_allclose(scorer.score(rows.iloc[i].to_dict()), expected[i])
+
+
+def test_categories(fitted):
+  prep, cph, scorer = fitted
+  assert 'level' in scorer.kinds
+  rows = complete_rows(prep).dropna(subset=ONE_HOT_VARS)
+  check(scorer, rows, expected(prep, cph, rows))
+
+
+def test_missing_categories(fitted):
+  prep, cph, scorer = fitted
+  rows = complete_rows(prep)
+  rows[ONE_HOT_VARS] = np.nan
+  check(scorer, rows, expected(prep, cph, rows))
+
+
+def test_absent_categories(fitted):
+  prep, cph, scorer = fitted
+  rows = complete_rows(prep)
+  absent = rows.drop(columns=ONE_HOT_VARS)
+  rows[ONE_HOT_VARS] = np.nan
+  check(scorer, absent, expected(prep, cph, rows))
@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from stability import stability
+
+
+def make_data(n=120, p=4, seed=0):
+  rs = np.random.RandomState(seed)
+  X = rs.normal(size=(n, p))
+  time = rs.exponential(np.exp(-X[:, 0]))
+  event = (rs.uniform(size=n) < 0.7).astype(float)
+  X_tr = pd.DataFrame(X, columns=['x{}'.format(j) for j in range(p)])
+  y_tr = pd.DataFrame({'censor_or_deceased_days': time, 'deceased_indicator': event})
+  return X_tr, y_tr
+
+
+def test_stability_defaults():
+  X_tr, y_tr = make_data()
+  results = stability(X_tr, y_tr, [0.1, 0.02], n_boot=20)
+  assert sorted(results) == [0.02, 0.1]
+  for df in results.values():
+    assert sorted(df.index) == list(X_tr.columns)
+    assert ((df['selected'] >= 0) & (df['selected'] <= 1)).all()
+    assert (df['lower'] <= df['upper']).all()
+
+
+def test_stability_seed_reproducible():
+  X_tr, y_tr = make_data()
+  a = stability(X_tr, y_tr, [0.05], n_boot=10, seed=3, workers=1)
+  b = stability(X_tr, y_tr, [0.05], n_boot=10, seed=3, workers=2)
+  pd.testing.assert_frame_equal(a[0.05], b[0.05])